@@ -1,120 +1,427 @@
-from nltk.util import ngrams
 from nltk.probability import FreqDist
 import utility as util
+import bz2
+import copy
+import gzip
+import hashlib
+import io
+import itertools
 import json
+import lzma
+import mmap
+import os.path
+import sqlite3
+import sys
 import time
+import math
+import multiprocessing
+import numpy as np
+
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict, deque
+from urllib.request import pathname2url
+
+BINARY_MAGIC = b'NGRAMBIN'
+SECTIONED_HEAD = b'{"index_offset": "'
+INDEX_OFFSET_WIDTH = 16
+INDEX_KEY = b', "index": '
+INDEX_SEARCH_SIZE = 2**16
+SAVE_BATCH_SIZE = 10000
+SMOOTHED_TABLES = ['smoothed_prob', 'smoothed_low_prob', 'backoff_weight']
+
+# Storage of the smoothed tables of a binary n-gram file, bits of the codebook indices or the float typecode
+QUANTIZATIONS = {'float32': 'f', 'codebook16': 16, 'codebook8': 8}
+SQLITE_MAGIC = b'SQLite format 3\x00'
+SQLITE_CACHE_SIZE = 2**16
+
+# Tables of an SQLite n-gram file and the column of the gram rows holding each of them
+SQLITE_TABLES = ['fdist', 'continuation_fdist', 'follow_fdist', 'pruned_fdist'] + SMOOTHED_TABLES
+SQLITE_COLUMNS = ['count', 'cont_count', 'follow', 'pruned', 'smoothed_prob', 'smoothed_low_prob', 'backoff_weight']
+
+SQLITE_TABLES_SQL = '''
+    CREATE TABLE gram (key TEXT PRIMARY KEY, n INTEGER, count INTEGER, cont_count INTEGER, follow TEXT, pruned INTEGER, smoothed_prob REAL, smoothed_low_prob REAL, backoff_weight REAL) WITHOUT ROWID;
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+COMPRESSIONS = {
+    'gzip': {'ext': '.gz', 'magic': b'\x1f\x8b', 'open': lambda fpath, mode: gzip.open(fpath, mode=mode, compresslevel=6)},
+    'xz': {'ext': '.xz', 'magic': b'\xfd7zXZ\x00', 'open': lambda fpath, mode: lzma.open(fpath, mode=mode)},
+    'bz2': {'ext': '.bz2', 'magic': b'BZh', 'open': lambda fpath, mode: bz2.open(fpath, mode=mode)}
+}
 
 class NGram():
-    def __init__(self, tokens=None, n=2, build_cont_fdist=True, build_follow_fdist=True, build_emission_prob=False, data_train=None, verbose=False):
+    def __init__(self, tokens=None, n=2, build_cont_fdist=True, build_follow_fdist=True, build_emission_prob=False, data_train=None, n_proc=1, verbose=False):
+        self.prefix_index = {}
+
         if tokens != None:
-            self.generate(tokens, n, build_cont_fdist, build_follow_fdist, build_emission_prob, data_train, verbose)
+            self.generate(tokens, n, build_cont_fdist, build_follow_fdist, build_emission_prob, data_train, n_proc, verbose)
     
 
     '''
     Desc: Initialize the n-gram
-    In  : tokens(list), n (int)
+    In  : tokens(list), n (int), n_proc (int)
     F.S.: NGram initialized with frequency and continuation frequency distributions of each nth-gram
     '''
-    def generate(self, tokens, n=2, build_cont_fdist=True, build_follow_fdist=True, build_emission_prob=False, data_train=None, verbose=False):
+    def generate(self, tokens, n=2, build_cont_fdist=True, build_follow_fdist=True, build_emission_prob=False, data_train=None, n_proc=1, verbose=False):
         start_t = time.time()
         n_tokens = len(tokens)
         util.printv(verbose, 'Number of words: ', n_tokens)
 
-        cp = util.ContinuousPrint()
-
-        # Build frequency table from unigram to n-gram
+        # Build frequency table from unigram to n-gram in a single pass
         util.printv(verbose, '\nBuilding frequency distribution')
-        self.n = n
-        self.grams = {}
-        self.fdist = {}
 
-        for i in range(1, n+1):
+        if n_proc > 1:
+            fdist = count_ngrams_parallel(tokens, n, n_proc, verbose)
+        else:
+            fdist = count_ngrams(tokens, n, verbose)
+        
+        emission_count = None
+
+        if build_emission_prob:
+            emission_count = count_emission(data_train, fdist[1])
+
+        self.generate_from_fdist(fdist, build_cont_fdist, build_follow_fdist, emission_count, verbose)
+
+        util.printv(verbose, '\nFinished building n-gram in {:.2f} s'.format(time.time() - start_t))
+    
+
+    '''
+    Desc: Initialize the n-gram from already counted frequency distributions
+    In  : fdist (dict), build_cont_fdist (bool), build_follow_fdist (bool), emission_count (dict), verbose (bool)
+    F.S.: NGram initialized with fdist and the tables derived from it
+    '''
+    def generate_from_fdist(self, fdist, build_cont_fdist=True, build_follow_fdist=True, emission_count=None, verbose=False):
+        self.n = max(fdist)
+        self.fdist = fdist
+        self.grams = {i: list(self.fdist[i].keys()) for i in self.fdist}
+
+        if build_cont_fdist or build_follow_fdist:
             start_ti = time.time()
-            self.fdist[i] = FreqDist()
+            util.printv(verbose, '\nBuilding continuation and follow frequency distribution')
+
+            continuation_fdist, follow_fdist = derive_fdist(self.fdist, self.n, build_cont_fdist, build_follow_fdist)
+
+            if build_cont_fdist:
+                self.continuation_fdist = continuation_fdist
+            
+            if build_follow_fdist:
+                self.follow_fdist = follow_fdist
+            
+            util.printv(verbose, 'DONE in {:.2f} s'.format(time.time() - start_ti))
+
+        if emission_count != None:
+            util.printv(verbose, '\nBuilding emission frequency distribution')
+            self.emission_prob = normalize_emission(emission_count, self.fdist[1])
+        
+        self.compute_stats()
+
+
+    '''
+    Desc: Add the counts of new tokens to the n-gram
+    In  : tokens (list), data_train (pd.DataFrame), verbose (bool)
+    F.S.: All tables updated to match an n-gram built from the old and new tokens together
+    '''
+    def update(self, tokens, data_train=None, verbose=False):
+        build_emission_prob = hasattr(self, 'emission_prob')
+        assert not build_emission_prob or data_train is not None
 
-            for j, word_tokens in enumerate(tokens):
-                word_ngrams = ngrams(word_tokens, n=i)
+        other = NGram(tokens, n=self.n, build_cont_fdist=False, build_follow_fdist=False, build_emission_prob=build_emission_prob, data_train=data_train, verbose=verbose)
+        self.merge(other)
+    
+
+    '''
+    Desc: Add the counts of another n-gram of the same order to the n-gram
+    In  : other (NGram)
+    F.S.: All tables updated to match an n-gram built from the tokens of both n-grams
+    '''
+    def merge(self, other):
+        assert other.n == self.n
+
+        # A pruned n-gram has lost the counts needed to update its tables
+        assert not hasattr(self, 'count_of_counts') and not hasattr(other, 'count_of_counts')
+
+        # Smoothed tables can not be updated from counts
+        assert not hasattr(self, 'smoothing') and not hasattr(other, 'smoothing')
+
+        merge_cont_fdist = hasattr(self, 'continuation_fdist')
+        merge_follow_fdist = hasattr(self, 'follow_fdist')
+        merge_emission_prob = hasattr(self, 'emission_prob')
+
+        # Emission probabilities are normalized by the unigram count, so get the raw counts before it changes
+        if merge_emission_prob:
+            assert hasattr(other, 'emission_prob')
+            emission_count = self.get_emission_count()
+            other_emission_count = other.get_emission_count()
 
-                # Count the frequency of each gram
-                for gram in word_ngrams:
-                    self.fdist[i][gram] += 1
+        for i in range(1, self.n+1):
+            fd = self.fdist[i]
+
+            for gram, count in other.fdist[i].items():
+                gram = self.encode_gram(other.decode_gram(gram), add=True)
+                count_old = fd[gram]
+                count_new = count_old + count
+                fd[gram] = count_new
+
+                if i == 1:
+                    continue
+
+                # A new distinct gram adds one continuation to its lower order gram
+                if merge_cont_fdist and count_old == 0:
+                    self.continuation_fdist[i-1][self.get_backoff(gram)] += 1
                 
-                util.printv(verbose, 'n: {}/{} | Words: {}/{}'.format(i, n, j, n_tokens), end='\r', cp=cp)
+                # Move the gram from the count-of-counts bucket of its old count to its new count
+                if merge_follow_fdist:
+                    ffd = self.follow_fdist[i-1]
+                    gram_prec = self.get_prec(gram)
+                    r_Nr = ffd.get(gram_prec)
+
+                    if r_Nr is None:
+                        r_Nr = ffd[gram_prec] = defaultdict(int, {0: 0})
+                    
+                    if count_old > 0:
+                        r_Nr[count_old] -= 1
 
-            self.grams[i] = list(self.fdist[i].keys())
+                        if r_Nr[count_old] == 0:
+                            del r_Nr[count_old]
+                    
+                    r_Nr[count_new] += 1
             
-            util.printv(verbose, 'n: {}/{} | DONE in {:.2f} s'.format(i, n, time.time() - start_ti))
+            self.grams[i] = list(fd.keys())
         
-        # Build continuation count table
-        if build_cont_fdist:
-            util.printv(verbose, '\nBuilding continuation frequency distribution')
-            self.continuation_fdist = {}
+        if merge_emission_prob:
+            for tag, sym_count in other_emission_count.items():
+                if tag not in emission_count:
+                    emission_count[tag] = FreqDist()
+                
+                emission_count[tag].update(sym_count)
+            
+            self.emission_prob = normalize_emission(emission_count, self.fdist[1], self.encode_gram)
+        
+        self.compute_stats()
+    
 
-            for i in range(1, n):
-                start_ti = time.time()
-                self.continuation_fdist[i] = FreqDist()
-                len_fdist = self.fdist[i+1].B()
+    '''
+    Desc: Get a view of the n-gram up to the nth-gram. The view shares the tables of the n-gram, so it must only
+          be read, not updated, merged or pruned
+    In  : n (int)
+    Out : NGram
+    '''
+    def view(self, n):
+        assert n <= self.n
 
-                for j, gram in enumerate(self.fdist[i+1]):
-                    self.continuation_fdist[i][gram[1:]] += 1
+        view = copy.copy(self)
+        view.n = n
 
-                    util.printv(verbose, 'n: {}/{} | Grams: {}/{}'.format(i, n-1, j, len_fdist), end='\r', cp=cp)
-                
-                util.printv(verbose, 'n: {}/{} | DONE in {:.2f} s'.format(i, n-1, time.time() - start_ti))
+        for table in ['fdist', 'continuation_fdist', 'follow_fdist', 'pruned_fdist', 'grams'] + SMOOTHED_TABLES:
+            if hasattr(self, table):
+                setattr(view, table, {i: t for i, t in getattr(self, table).items() if i <= n})
         
-        # Build follow count table
-        if build_follow_fdist:
-            util.printv(verbose, '\nBuilding follow frequency distribution')
-            self.follow_fdist = {}
+        if hasattr(self, 'count_of_counts'):
+            view.count_of_counts = {table: {i: coc for i, coc in table_coc.items() if i <= n} for table, table_coc in self.count_of_counts.items()}
+        
+        view.stats = {table: {i: st for i, st in table_stats.items() if i <= n} for table, table_stats in self.stats.items()}
+        
+        return view
 
-            for i in range(1, n):
-                start_ti = time.time()
-                self.follow_fdist[i] = {}
-                len_fdist = self.fdist[i+1].B()
 
-                for j, gram in enumerate(self.fdist[i+1]):
-                    gram_prec = gram[:-1]
+    '''
+    Desc: Recover the raw emission counts from the emission probabilities
+    Out : dict
+    '''
+    def get_emission_count(self):
+        emission_count = {}
 
-                    if gram_prec not in self.follow_fdist[i]:
-                        self.follow_fdist[i][gram_prec] = FreqDist()
-                    
-                    self.follow_fdist[i][gram_prec][gram[-1]] += self.fdist[i+1][gram]
+        for tag, ep in self.emission_prob.items():
+            tag_freq = self.get_count(self.encode_gram((tag,)))
+            emission_count[tag] = FreqDist({sym: round(prob * tag_freq) for sym, prob in ep.items()})
+        
+        return emission_count
 
-                    util.printv(verbose, 'n: {}/{} | [Pass 1] Grams: {}/{}'.format(i, n-1, j, len_fdist), end='\r', cp=cp)
-                
-                # Truncate to count distribution
-                len_fdist = len(self.follow_fdist[i])
 
-                for gram_prec, fdist in self.follow_fdist[i].items():
-                    self.follow_fdist[i][gram_prec] = fdist.r_Nr()
+    '''
+    Desc: Prune bigrams and higher order grams whose score is below threshold. The score is either the raw
+          count or the weighted difference between the log probability of the gram and of its back-off gram
+          (an approximation of the relative entropy lost by pruning it). If target_grams or max_size (bytes,
+          see estimate_size) is given, the lowest scoring grams are also pruned until the model fits.
+          The preceding and back-off grams of a kept gram are always kept, then the continuation and follow
+          tables are derived again from the pruned counts. The total count of the pruned grams following each
+          gram is kept in pruned_fdist so kn and gkn give it to the back-off, and the count-of-counts of the
+          unpruned model are kept in count_of_counts so the discounts of gkn do not change
+    In  : criterion (str), threshold (float), target_grams (int), max_size (int), verbose (bool)
+    F.S.: Tables pruned in place
+    '''
+    def prune(self, criterion="count", threshold=None, target_grams=None, max_size=None, verbose=False):
+        assert criterion in ["count", "entropy"]
+        assert not hasattr(self, 'smoothing')
+        start_t = time.time()
 
-                    util.printv(verbose, 'n: {}/{} | [Pass 2] Grams: {}/{}'.format(i, n-1, j, len_fdist), end='\r', cp=cp)
-                
-                util.printv(verbose, 'n: {}/{} | DONE in {:.2f} s'.format(i, n-1, time.time() - start_ti))
+        n_grams_old = sum(len(fd) for fd in self.fdist.values())
+        size_old = estimate_size(self)
 
-        if build_emission_prob:
-            util.printv(verbose, '\nBuilding emission frequency distribution')
-            self.emission_prob = {}
+        if max_size != None:
+            # Assume the size grows linearly with the number of grams
+            target_max_size = int(n_grams_old * max_size / size_old)
+            target_grams = target_max_size if target_grams == None else min(target_grams, target_max_size)
 
-            for row in data_train.itertuples():
-                for i in range(len(row.word)):
-                    if self.fdist[1][(row.syllables[i],)] < 1:
-                        continue
+        if not hasattr(self, 'count_of_counts'):
+            self.count_of_counts = {table: {i: st['r_Nr'] for i, st in table_stats.items()} for table, table_stats in self.stats.items()}
 
-                    if row.syllables[i] not in self.emission_prob:
-                        self.emission_prob[row.syllables[i]] = FreqDist()
-                    
-                    self.emission_prob[row.syllables[i]][row.word[i]] += 1
-            
-            for tag in self.emission_prob:
-                tag_freq = self.fdist[1][(tag,)]
+        # Score every gram from bigram and higher
+        n_unigrams = self.get_total_count(1)
+        scores = {}
 
-                for sym in self.emission_prob[tag]:
-                    self.emission_prob[tag][sym] = self.emission_prob[tag][sym] / tag_freq
+        for i in range(2, self.n+1):
+            scores[i] = {}
 
-        util.printv(verbose, '\nFinished building n-gram in {:.2f} s'.format(time.time() - start_t))
+            for gram, count in self.fdist[i].items():
+                if criterion == "count":
+                    scores[i][gram] = count
+                else:
+                    gram_backoff = self.get_backoff(gram)
+                    count_backoff_prec = self.get_count(self.get_prec(gram_backoff)) if i > 2 else n_unigrams
+
+                    prob = count / self.get_count(self.get_prec(gram))
+                    prob_backoff = self.get_count(gram_backoff) / count_backoff_prec
+                    scores[i][gram] = count * (math.log(prob) - math.log(prob_backoff))
+
+        # A gram scores at least as high as the grams extending it, so a kept gram always has its preceding
+        # and back-off grams kept
+        for i in range(self.n, 2, -1):
+            scores_low = scores[i-1]
+
+            for gram, score in scores[i].items():
+                for gram_low in (self.get_prec(gram), self.get_backoff(gram)):
+                    if score > scores_low[gram_low]:
+                        scores_low[gram_low] = score
+
+        fdist = self.fdist
+        pruned_fdist = getattr(self, 'pruned_fdist', {})
+        all_scores = sorted((s for i in scores for s in scores[i].values()), reverse=True)
+        n_keep = None if target_grams == None else target_grams - len(fdist[1])
+
+        build_cont_fdist = hasattr(self, 'continuation_fdist')
+        build_follow_fdist = hasattr(self, 'follow_fdist')
+
+        while True:
+            # Lowest score to be kept to reach the target number of grams
+            min_score = threshold
+
+            if n_keep != None and n_keep < len(all_scores):
+                min_score_keep = all_scores[n_keep-1] if n_keep > 0 else math.inf
+
+                # Grams tied on the last kept score are pruned together
+                if n_keep > 0 and all_scores[n_keep] == min_score_keep:
+                    min_score_keep = math.nextafter(min_score_keep, math.inf)
+
+                min_score = min_score_keep if min_score == None else max(min_score, min_score_keep)
+
+            if min_score != None:
+                self.fdist = {1: fdist[1]}
+                self.pruned_fdist = {}
+
+                for i in range(2, self.n+1):
+                    fd = FreqDist()
+
+                    # Keep the mass pruned earlier from a gram that is still kept
+                    pfd = {gram: count for gram, count in pruned_fdist.get(i-1, {}).items() if gram in self.fdist[i-1]}
+
+                    for gram, count in fdist[i].items():
+                        if scores[i][gram] >= min_score:
+                            fd[gram] = count
+                            continue
+
+                        # The mass of a pruned gram goes to the back-off of its preceding gram
+                        gram_prec = self.get_prec(gram)
+
+                        if gram_prec in self.fdist[i-1]:
+                            pfd[gram_prec] = pfd.get(gram_prec, 0) + count
+
+                    self.fdist[i] = fd
+                    self.pruned_fdist[i-1] = FreqDist(pfd)
+
+            # Repair the tables derived from the pruned counts
+            if build_cont_fdist or build_follow_fdist:
+                continuation_fdist, follow_fdist = derive_fdist(self.fdist, self.n, build_cont_fdist, build_follow_fdist)
+
+                if build_cont_fdist:
+                    self.continuation_fdist = continuation_fdist
+
+                if build_follow_fdist:
+                    self.follow_fdist = follow_fdist
+
+            if max_size == None:
+                break
+
+            # The follow tables do not shrink linearly, so shrink the target until the model fits
+            size = estimate_size(self)
+            n_kept = sum(len(self.fdist[i]) for i in range(2, self.n+1))
+
+            if size <= max_size or n_kept == 0:
+                break
+
+            n_keep = min(int(n_kept * max_size / size), n_kept - 1)
+
+        self.grams = {i: list(fd.keys()) for i, fd in self.fdist.items()}
+        self.compute_stats()
+
+        n_grams_new = sum(len(fd) for fd in self.fdist.values())
+        util.printv(verbose, '\nPruned {} of {} grams ({} criterion) in {:.2f} s'.format(n_grams_old - n_grams_new, n_grams_old, criterion, time.time() - start_t))
+
+        for i in range(1, self.n+1):
+            util.printv(verbose, '{}-gram: {}'.format(i, len(self.fdist[i])))
+
+        util.printv(verbose, 'Estimated size: {:.2f} MB -> {:.2f} MB'.format(size_old / 2**20, estimate_size(self) / 2**20))
+
+
+    '''
+    Desc: Compute the total count, the number of distinct grams and the count-of-counts of every order of the
+          frequency and continuation frequency distributions, so the smoothing methods never count them again.
+          The index of continuations of the old counts is dropped too
+    F.S.: Statistics stored in stats
+    '''
+    def compute_stats(self):
+        self.stats = {}
+        self.prefix_index = {}
+
+        for table in ['fdist', 'continuation_fdist']:
+            if hasattr(self, table):
+                self.stats[table] = {i: {'N': fd.N(), 'B': fd.B(), 'r_Nr': fd.r_Nr()} for i, fd in getattr(self, table).items()}
+    
+
+    '''
+    Desc: Get the total count of the frequency or continuation frequency distribution of the nth-gram
+    In  : n (int), continuation (bool)
+    Out : int
+    '''
+    def get_total_count(self, n, continuation=False):
+        return self.stats['continuation_fdist' if continuation else 'fdist'][n]['N']
     
 
+    '''
+    Desc: Get the number of distinct grams of the frequency or continuation frequency distribution of the nth-gram
+    In  : n (int), continuation (bool)
+    Out : int
+    '''
+    def get_type_count(self, n, continuation=False):
+        return self.stats['continuation_fdist' if continuation else 'fdist'][n]['B']
+
+
+    '''
+    Desc: Get the count-of-counts of the frequency or continuation frequency distribution of the nth-gram,
+          taken before pruning if the n-gram is pruned
+    In  : n (int), continuation (bool)
+    Out : dict
+    '''
+    def get_count_of_counts(self, n, continuation=False):
+        table = 'continuation_fdist' if continuation else 'fdist'
+
+        if hasattr(self, 'count_of_counts') and table in self.count_of_counts:
+            return self.count_of_counts[table][n]
+
+        return self.stats[table][n]['r_Nr']
+
+
     '''
     Desc: Get maximum n size
     Out : int
@@ -165,7 +472,37 @@ class NGram():
         n = len(gram)
         assert n <= self.n
 
-        return self.follow_fdist[n][gram]
+        # Every follower of a gram may have been pruned
+        r_Nr = self.follow_fdist[n].get(gram)
+
+        return FreqDist() if r_Nr is None else r_Nr
+
+
+    '''
+    Desc: Get the grams following a gram, from an index of the grams of the next order by their preceding gram.
+          The index of an order is built on its first lookup and shared by the views of the n-gram
+    In  : gram (tuple)
+    Out : list
+    '''
+    def get_continuations(self, gram):
+        n = self.get_order(gram)
+        assert n < self.n
+
+        index = self.prefix_index.get(n)
+
+        if index == None:
+            index = self.prefix_index[n] = {}
+
+            for gram_next in self.fdist[n+1]:
+                gram_prec = self.get_prec(gram_next)
+                continuations = index.get(gram_prec)
+
+                if continuations == None:
+                    index[gram_prec] = [gram_next]
+                else:
+                    continuations.append(gram_next)
+        
+        return index.get(gram, [])
 
 
     '''
@@ -193,15 +530,83 @@ class NGram():
     
     
     '''
-    Desc: Get the follow frequency of a gram
+    Desc: Get the follow frequency of a gram, the number of distinct grams following it
     In  : gram (tuple)
     Out : int
     '''
     def get_follow_count(self, gram):
-        n = len(gram)
+        n = self.get_order(gram)
         assert n < self.n
+
+        r_Nr = self.follow_fdist[n].get(gram)
+        return 0 if r_Nr == None else sum(r_Nr.values())
+
+
+    '''
+    Desc: Get the total count of the pruned grams following a gram
+    In  : gram (tuple)
+    Out : int
+    '''
+    def get_pruned_count(self, gram):
+        if not hasattr(self, 'pruned_fdist'):
+            return 0
         
-        return sum(self.follow_fdist[n][gram].values())
+        return self.pruned_fdist[len(gram)].get(gram, 0)
+
+
+    '''
+    Desc: Get the order of a gram
+    In  : gram (tuple)
+    Out : int
+    '''
+    def get_order(self, gram):
+        return len(gram)
+    
+
+    '''
+    Desc: Get the preceding gram (context) of a gram, without its last tag
+    In  : gram (tuple)
+    Out : tuple
+    '''
+    def get_prec(self, gram):
+        return gram[:-1]
+    
+
+    '''
+    Desc: Get the lower order gram used for back-off, without its first tag
+    In  : gram (tuple)
+    Out : tuple
+    '''
+    def get_backoff(self, gram):
+        return gram[1:]
+    
+
+    '''
+    Desc: Prepend a tag to a gram
+    In  : tag (str), gram (tuple)
+    Out : tuple
+    '''
+    def prepend_tag(self, tag, gram):
+        return (tag,) + gram
+    
+
+    '''
+    Desc: Encode a tuple of tags to the gram key used by the n-gram tables. New tags are only added to the keys
+          of the n-gram if add is set, when the gram is added to the tables
+    In  : tags (tuple), add (bool)
+    Out : tuple
+    '''
+    def encode_gram(self, tags, add=False):
+        return tags
+    
+
+    '''
+    Desc: Decode a gram key back to a tuple of tags
+    In  : gram (tuple)
+    Out : tuple
+    '''
+    def decode_gram(self, gram):
+        return gram
 
 
     '''
@@ -220,126 +625,2033 @@ class NGram():
 
 
 '''
-Desc: Encode the n-gram to JSON and save it in a file
-In  : ngram (NGram), fname (str), fdir (str)
-F.S.: n-gram saved in a file
+Desc: Interned tag vocabulary. Each tag gets an integer id (0 is reserved) and a gram is packed into a single
+      int with the first tag in the lowest bits, so dropping the first or last tag of a gram is a shift or a
+      mask instead of a tuple slice. The last id is reserved for the tags looked up but not interned, so looking
+      up a gram never changes the vocabulary of a model
 '''
-def save(ngram, fname, fdir):
-    data = {
-        'N': ngram.n,
-        'fdist': {}
-    }
-    
-    # Encode frequency distribution
-    for i, fd in ngram.fdist.items():
-        data['fdist'][i] = {}
-        
-        for k, v in fd.items():
-            data['fdist'][i][util.tags_to_str(k)] = v
+class Vocab():
+    def __init__(self, tags=None, bits=7):
+        self.bits = bits
+        self.tag_mask = (1 << bits) - 1
+        self.unknown_id = self.tag_mask
+        self.tags = [None]
+        self.ids = {}
+
+        if tags != None:
+            for tag in tags:
+                self.get_id(tag)
     
-    # Encode continuation frequency distribution
-    if hasattr(ngram, 'continuation_fdist'):
-        data['continuation_fdist'] = {}
 
-        for i, cfd in ngram.continuation_fdist.items():
-            data['continuation_fdist'][i] = {}
+    '''
+    Desc: Get the id of a tag, interning it if it is new
+    In  : tag (str)
+    Out : int
+    '''
+    def get_id(self, tag):
+        tag_id = self.ids.get(tag)
 
-            for k, v in cfd.items():
-                data['continuation_fdist'][i][util.tags_to_str(k)] = v
-    
-    # Encode follow frequency distribution
-    if hasattr(ngram, 'follow_fdist'):
-        data['follow_fdist'] = {}
+        if tag_id == None:
+            tag_id = len(self.tags)
 
-        for i, ffd in ngram.follow_fdist.items():
-            data['follow_fdist'][i] = {}
+            if tag_id >= self.unknown_id:
+                raise ValueError(f"Vocabulary is full, can not intern more than {self.unknown_id - 1} tags with {self.bits} bits")
+            
+            self.ids[tag] = tag_id
+            self.tags.append(tag)
+        
+        return tag_id
+    
 
-            for k, v in ffd.items():
-                data['follow_fdist'][i][util.tags_to_str(k)] = v
+    '''
+    Desc: Get the id of a tag without interning it
+    In  : tag (str)
+    Out : int, unknown_id if the tag is not in the vocabulary
+    '''
+    def lookup(self, tag):
+        return self.ids.get(tag, self.unknown_id)
     
-    # Encode emission probabilities
-    if hasattr(ngram, 'emission_prob'):
-        data['emission_prob'] = {}
 
-        for tag, ep in ngram.emission_prob.items():
-            data['emission_prob'][tag] = ep
+    '''
+    Desc: Pack a tuple of tags into a single int, interning the new tags if add is set or else packing them as
+          unknown_id
+    In  : tags (tuple), add (bool)
+    Out : int
+    '''
+    def pack(self, tags, add=True):
+        get_id = self.get_id if add else self.lookup
+        key = 0
 
-            #for k, v in ep.items():
-            #    data['emission_prob'][tag][k] = v
+        for tag in reversed(tags):
+            key = (key << self.bits) | get_id(tag)
+        
+        return key
     
-    # Write to file
-    fpath = f"{fdir}/{fname}.json" 
 
-    with open(fpath, mode='w', encoding='utf-8') as f:
-        f.write(json.dumps(data, ensure_ascii=False))
+    '''
+    Desc: Unpack an int into a tuple of tags, an unknown tag is unpacked as None
+    In  : key (int)
+    Out : tuple
+    '''
+    def unpack(self, key):
+        tags = []
+
+        while key:
+            tag_id = key & self.tag_mask
+            tags.append(None if tag_id == self.unknown_id else self.tags[tag_id])
+            key >>= self.bits
+        
+        return tuple(tags)
 
 
 '''
-Desc: Load n-gram from a file and decode it
-In  : fpath (str), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool)
-Out : NGram
+Desc: n-gram whose tables are keyed by packed int grams (see Vocab) instead of tuples of tags
 '''
-def load(fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False):
-    with open(fpath, encoding='utf-8') as f:
-        data = json.loads(f.read())
+class PackedNGram(NGram):
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.bits = vocab.bits
+        self.prefix_index = {}
+    
 
-    # n_max denotes max nth-gram loaded
-    if n_max == None:
-        n_max = data['N']
+    def get_order(self, gram):
+        return (gram.bit_length() + self.bits - 1) // self.bits
     
-    assert n_max <= data['N']
 
-    ngram = NGram()
-    ngram.n = n_max
+    def get_prec(self, gram):
+        return gram & ((1 << (self.get_order(gram) - 1) * self.bits) - 1)
     
-    # Decode frequency distribution
-    ngram.fdist = {}
 
-    for i, fd in data['fdist'].items():
-        i = int(i)
-        
-        if i > n_max:
-            continue 
+    def get_backoff(self, gram):
+        return gram >> self.bits
+    
 
-        ngram.fdist[i] = FreqDist()
+    def prepend_tag(self, tag, gram):
+        return (gram << self.bits) | self.vocab.lookup(tag)
+    
 
-        for k, v in fd.items():
-            tags = util.str_to_tags(k)
-            ngram.fdist[i][tags] = int(v)
+    def encode_gram(self, tags, add=False):
+        return self.vocab.pack(tags, add)
     
-    # Decode continuation frequency distribution
-    if load_cont_fdist:
-        ngram.continuation_fdist = {}
 
-        for i, cfd in data['continuation_fdist'].items():
-            i = int(i)
+    def decode_gram(self, gram):
+        return self.vocab.unpack(gram)
+    
 
-            if i > n_max:
-                continue 
+    def get_follow_fdist(self, gram):
+        n = self.get_order(gram)
+        assert n <= self.n
 
-            ngram.continuation_fdist[i] = FreqDist()
+        # Every follower of a gram may have been pruned
+        r_Nr = self.follow_fdist[n].get(gram)
 
-            for k, v in cfd.items():
-                tags = util.str_to_tags(k)
-                ngram.continuation_fdist[i][tags] = int(v)
+        return FreqDist() if r_Nr is None else r_Nr
     
-    # Decode follow frequency distribution
-    if load_follow_fdist:
-        ngram.follow_fdist = {}
 
-        for i, ffd in data['follow_fdist'].items():
-            i = int(i)
+    def get_count(self, gram):
+        n = self.get_order(gram)
+        assert n <= self.n
 
-            if i > n_max:
-                continue 
-            
-            ngram.follow_fdist[i] = {}
+        return self.fdist[n][gram]
+    
 
-            for gram, fdist in ffd.items():
-                tags = util.str_to_tags(gram)
-                ngram.follow_fdist[i][tags] = FreqDist()
+    def get_continuation_count(self, gram):
+        n = self.get_order(gram)
+        assert n < self.n
 
-                for k, v in fdist.items():
+        return self.continuation_fdist[n][gram]
+    
+
+    def get_pruned_count(self, gram):
+        if not hasattr(self, 'pruned_fdist'):
+            return 0
+        
+        return self.pruned_fdist[self.get_order(gram)].get(gram, 0)
+    
+
+    def print_fdist(self, n=None, limit=None):
+        if n == None:
+            n = self.n
+        
+        if limit == None:
+            limit = len(self.fdist[n])
+        
+        for gram, count in self.fdist[n].most_common()[:limit]:
+            print(self.decode_gram(gram), ': ', count)
+
+
+'''
+Desc: Convert an n-gram to packed int keys. Tables are moved out of ngram one by one to limit peak memory,
+      so ngram should not be used afterwards
+In  : ngram (NGram), vocab (Vocab)
+Out : PackedNGram
+'''
+def pack(ngram, vocab=None):
+    if vocab == None:
+        vocab = Vocab()
+
+    # Intern the unigram tags first so the most common tags get the smallest ids
+    for gram, _ in ngram.fdist[1].most_common():
+        vocab.get_id(ngram.decode_gram(gram)[0])
+
+    packed = PackedNGram(vocab)
+    packed.n = ngram.n
+
+    def pack_tables(tables):
+        packed_tables = {}
+
+        for i in list(tables.keys()):
+            table = tables.pop(i)
+            packed_table = {vocab.pack(ngram.decode_gram(k)): v for k, v in table.items()}
+            packed_tables[i] = FreqDist(packed_table) if isinstance(table, (FreqDist, MappedTable, TrieTable, SQLiteTable)) else packed_table
+        
+        return packed_tables
+
+    packed.fdist = pack_tables(ngram.fdist)
+    packed.grams = {i: list(packed.fdist[i].keys()) for i in packed.fdist}
+
+    if hasattr(ngram, 'continuation_fdist'):
+        packed.continuation_fdist = pack_tables(ngram.continuation_fdist)
+    
+    if hasattr(ngram, 'follow_fdist'):
+        packed.follow_fdist = pack_tables(ngram.follow_fdist)
+    
+    if hasattr(ngram, 'pruned_fdist'):
+        packed.pruned_fdist = pack_tables(ngram.pruned_fdist)
+    
+    if hasattr(ngram, 'emission_prob'):
+        packed.emission_prob = ngram.emission_prob
+    
+    if hasattr(ngram, 'count_of_counts'):
+        packed.count_of_counts = ngram.count_of_counts
+    
+    packed.stats = ngram.stats
+    
+    if hasattr(ngram, 'smoothing'):
+        for table in SMOOTHED_TABLES:
+            setattr(packed, table, pack_tables(getattr(ngram, table)))
+        
+        packed.smoothing = ngram.smoothing
+    
+    return packed
+
+
+'''
+Desc: Read-only frequency distribution over two memory-mapped arrays, the sorted packed gram keys and their
+      values. Missing grams have a value of 0, like nltk.FreqDist
+'''
+class MappedTable():
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+        self._len = len(keys)
+        self._r_Nr = None
+    
+
+    '''
+    Desc: Get the position of a key in the arrays
+    In  : key (int)
+    Out : int, -1 if the key does not exist
+    '''
+    def index(self, key):
+        i = bisect_left(self._keys, key)
+
+        if i < self._len and self._keys[i] == key:
+            return i
+        
+        return -1
+    
+
+    def get(self, key, default=None):
+        i = bisect_left(self._keys, key)
+
+        if i < self._len and self._keys[i] == key:
+            return self._values[i]
+        
+        return default
+    
+
+    def __getitem__(self, key):
+        i = bisect_left(self._keys, key)
+
+        if i < self._len and self._keys[i] == key:
+            return self._values[i]
+        
+        return 0
+    
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+    
+
+    def __len__(self):
+        return self._len
+    
+
+    def __iter__(self):
+        return iter(self._keys)
+    
+
+    def keys(self):
+        return iter(self._keys)
+    
+
+    def values(self):
+        return iter(self._values)
+    
+
+    def items(self):
+        return zip(self._keys, self._values)
+    
+
+    def most_common(self, n=None):
+        return sorted(self.items(), key=lambda item: item[1], reverse=True)[:n]
+    
+
+    def B(self):
+        return self._len
+    
+
+    def N(self):
+        return sum(self._values)
+    
+
+    def r_Nr(self):
+        if self._r_Nr == None:
+            self._r_Nr = defaultdict(int, Counter(self._values))
+            self._r_Nr[0] = 0
+        
+        return self._r_Nr
+
+
+'''
+Desc: Read-only follow (count-of-counts) table over memory-mapped arrays. The count-of-counts of the gram at
+      position i are the pairs (counts[j], nrs[j]) for offsets[i] <= j < offsets[i+1]
+'''
+class MappedFollowTable():
+    def __init__(self, keys, offsets, counts, nrs):
+        self._keys = MappedTable(keys, offsets)
+        self._offsets = offsets
+        self._counts = counts
+        self._nrs = nrs
+    
+
+    def get(self, key, default=None):
+        i = self._keys.index(key)
+
+        if i < 0:
+            return default
+        
+        # Same layout as FreqDist.r_Nr()
+        start, end = self._offsets[i], self._offsets[i+1]
+        r_Nr = defaultdict(int, zip(self._counts[start:end], self._nrs[start:end]))
+        r_Nr[0] = 0
+
+        return r_Nr
+    
+
+    def __getitem__(self, key):
+        r_Nr = self.get(key)
+
+        if r_Nr is None:
+            raise KeyError(key)
+        
+        return r_Nr
+    
+
+    def __contains__(self, key):
+        return key in self._keys
+    
+
+    def __len__(self):
+        return len(self._keys)
+    
+
+    def __iter__(self):
+        return iter(self._keys)
+    
+
+    def keys(self):
+        return iter(self._keys)
+    
+
+    def items(self):
+        return ((key, self[key]) for key in self._keys)
+    
+
+    '''
+    Desc: Get the number of distinct grams following a gram without building its count-of-counts
+    In  : key (int)
+    Out : int
+    '''
+    def get_follow_count(self, key):
+        i = self._keys.index(key)
+        return 0 if i < 0 else sum(self._nrs[self._offsets[i]:self._offsets[i+1]])
+
+
+'''
+Desc: Read-only array of the values of a quantized table, an array of indices into a codebook of values
+'''
+class CodebookArray():
+    def __init__(self, codes, codebook):
+        self.codes = codes
+        self.codebook = codebook
+    
+
+    def __getitem__(self, i):
+        return self.codebook[self.codes[i]]
+    
+
+    def __len__(self):
+        return len(self.codes)
+    
+
+    def __iter__(self):
+        return (self.codebook[code] for code in self.codes)
+
+
+'''
+Desc: Get the keys and values of a packed table as arrays sorted by key, for vectorized lookups (np.searchsorted).
+      The arrays of a mapped table are views of the model file, except the values of a quantized table
+In  : table (dict or MappedTable)
+Out : (np.ndarray, np.ndarray)
+'''
+def table_arrays(table):
+    if isinstance(table, MappedTable) and isinstance(table._values, CodebookArray):
+        return np.asarray(table._keys, dtype=np.uint64), np.asarray(table._values.codebook, dtype=np.float64)[np.asarray(table._values.codes)]
+
+    if isinstance(table, MappedTable):
+        return np.asarray(table._keys, dtype=np.uint64), np.asarray(table._values, dtype=np.float64)
+    
+    keys = np.fromiter(table.keys(), dtype=np.uint64, count=len(table))
+    values = np.fromiter(table.values(), dtype=np.float64, count=len(table))
+    order = np.argsort(keys)
+
+    return keys[order], values[order]
+
+
+'''
+Desc: Packed n-gram whose tables are served from a memory-mapped binary model file (see save_binary) instead of
+      being decoded into memory. It is read-only, so it can not be updated, merged or pruned
+'''
+class MappedNGram(PackedNGram):
+    def __init__(self, vocab, mm):
+        super().__init__(vocab)
+        self.mm = mm
+    
+
+    # The mapped follow table counts the followers without building an index in memory
+    def get_follow_count(self, gram):
+        n = self.get_order(gram)
+        assert n < self.n
+
+        return self.follow_fdist[n].get_follow_count(gram)
+
+
+'''
+Desc: Node of a TrieNGram, the gram made of its tag followed by the tags of its parent. The parent of a node is
+      its back-off gram, and its children are the grams one tag longer at the front
+'''
+class TrieNode():
+    __slots__ = ('tag', 'parent', 'children', 'count', 'cont_count', 'follow')
+
+    def __init__(self, tag=None, parent=None):
+        self.tag = tag
+        self.parent = parent
+        self.children = None
+        self.count = 0
+        self.cont_count = 0
+        self.follow = None
+    
+
+    '''
+    Desc: Get the gram of the node, following the parent pointers up to the root
+    Out : tuple
+    '''
+    def get_gram(self):
+        tags = []
+        node = self
+
+        while node.parent is not None:
+            tags.append(node.tag)
+            node = node.parent
+        
+        return tuple(tags)
+
+
+'''
+Desc: Read-only frequency or continuation frequency distribution of one order of a TrieNGram, the field of its
+      nodes at that depth. Missing grams have a value of 0, like nltk.FreqDist
+'''
+class TrieTable():
+    def __init__(self, trie, nodes, field):
+        self._trie = trie
+        self._nodes = nodes
+        self._field = field
+        self._r_Nr = None
+    
+
+    def get(self, key, default=None):
+        node = self._trie.get_node(key)
+        value = 0 if node is None else getattr(node, self._field)
+
+        return value if value else default
+    
+
+    def __getitem__(self, key):
+        node = self._trie.get_node(key)
+        return 0 if node is None else getattr(node, self._field)
+    
+
+    def __contains__(self, key):
+        return bool(self[key])
+    
+
+    def __len__(self):
+        return sum(1 for _ in self.values())
+    
+
+    def __iter__(self):
+        return self.keys()
+    
+
+    def keys(self):
+        return (node.get_gram() for node in self._nodes if getattr(node, self._field))
+    
+
+    def values(self):
+        return (value for value in (getattr(node, self._field) for node in self._nodes) if value)
+    
+
+    def items(self):
+        return ((node.get_gram(), getattr(node, self._field)) for node in self._nodes if getattr(node, self._field))
+    
+
+    def most_common(self, n=None):
+        return sorted(self.items(), key=lambda item: item[1], reverse=True)[:n]
+    
+
+    def B(self):
+        return len(self)
+    
+
+    def N(self):
+        return sum(self.values())
+    
+
+    def r_Nr(self):
+        if self._r_Nr == None:
+            self._r_Nr = defaultdict(int, Counter(self.values()))
+            self._r_Nr[0] = 0
+        
+        return self._r_Nr
+
+
+'''
+Desc: Read-only follow (count-of-counts) table of one order of a TrieNGram. The count-of-counts of a gram are
+      kept in its node as a flat tuple of (count, Nr) pairs
+'''
+class TrieFollowTable():
+    def __init__(self, trie, nodes):
+        self._trie = trie
+        self._nodes = nodes
+    
+
+    def get(self, key, default=None):
+        node = self._trie.get_node(key)
+
+        if node is None or node.follow is None:
+            return default
+        
+        # Same layout as FreqDist.r_Nr()
+        r_Nr = defaultdict(int, zip(node.follow[::2], node.follow[1::2]))
+        r_Nr[0] = 0
+
+        return r_Nr
+    
+
+    def __getitem__(self, key):
+        r_Nr = self.get(key)
+
+        if r_Nr is None:
+            raise KeyError(key)
+        
+        return r_Nr
+    
+
+    def __contains__(self, key):
+        node = self._trie.get_node(key)
+        return node is not None and node.follow is not None
+    
+
+    def __len__(self):
+        return sum(1 for node in self._nodes if node.follow is not None)
+    
+
+    def __iter__(self):
+        return self.keys()
+    
+
+    def keys(self):
+        return (node.get_gram() for node in self._nodes if node.follow is not None)
+    
+
+    def items(self):
+        return ((key, self[key]) for key in self.keys())
+    
+
+    '''
+    Desc: Get the number of distinct grams following a gram without building its count-of-counts
+    In  : key (tuple)
+    Out : int
+    '''
+    def get_follow_count(self, key):
+        node = self._trie.get_node(key)
+        return 0 if node is None or node.follow is None else sum(node.follow[1::2])
+
+
+'''
+Desc: n-gram whose count, continuation count and follow tables are stored in a trie of contexts instead of one
+      dict per table and order. A gram is stored once in its node, the tags of a gram are shared with every gram
+      ending with it, and the back-off gram of a node is its parent. The grams are looked up from their last tag,
+      one tag per level. It is read-only, so it can not be updated, merged or pruned
+'''
+class TrieNGram(NGram):
+    def __init__(self):
+        self.root = TrieNode()
+        self.nodes = {}
+        self.prefix_index = {}
+    
+
+    '''
+    Desc: Get the node of a gram
+    In  : gram (tuple)
+    Out : TrieNode, None if the gram is not in the trie
+    '''
+    def get_node(self, gram):
+        node = self.root
+
+        for tag in reversed(gram):
+            if node.children is None:
+                return None
+            
+            node = node.children.get(tag)
+
+            if node is None:
+                return None
+        
+        return node
+    
+
+    '''
+    Desc: Get the node of a gram, adding the missing nodes of the gram and of its back-off grams
+    In  : gram (tuple)
+    Out : TrieNode
+    '''
+    def add_node(self, gram):
+        node = self.root
+
+        for i, tag in enumerate(reversed(gram)):
+            if node.children is None:
+                node.children = {}
+
+            child = node.children.get(tag)
+
+            if child is None:
+                child = node.children[tag] = TrieNode(tag, node)
+                self.nodes.setdefault(i+1, []).append(child)
+            
+            node = child
+        
+        return node
+    
+
+    # The follow table counts the followers without building an index
+    def get_follow_count(self, gram):
+        n = len(gram)
+        assert n < self.n
+
+        return self.follow_fdist[n].get_follow_count(gram)
+    
+
+    def get_count(self, gram):
+        assert len(gram) <= self.n
+
+        node = self.get_node(gram)
+        return 0 if node is None else node.count
+    
+
+    def get_continuation_count(self, gram):
+        assert len(gram) < self.n
+
+        node = self.get_node(gram)
+        return 0 if node is None else node.cont_count
+
+
+'''
+Desc: Convert an n-gram to a TrieNGram. The tables of ngram are emptied as they are converted, so ngram can not
+      be used afterwards. The memory of a table is only freed if nothing else refers to it, so ngram should be a
+      freshly loaded n-gram, not a view of a cached one (see Registry.load)
+In  : ngram (NGram)
+Out : TrieNGram
+'''
+def to_trie(ngram):
+    trie = TrieNGram()
+    trie.n = ngram.n
+
+    # One string object per tag, shared by every node of the tag
+    tags = {}
+
+    def add_table(tables, add):
+        for i in list(tables.keys()):
+            for k, v in tables.pop(i).items():
+                gram = tuple(tags.setdefault(tag, tag) for tag in ngram.decode_gram(k))
+                add(trie.add_node(gram), v)
+
+    def set_count(node, count):
+        node.count = count
+
+    def set_cont_count(node, count):
+        node.cont_count = count
+
+    def set_follow(node, r_Nr):
+        node.follow = tuple(x for r, Nr in r_Nr.items() if r > 0 for x in (r, Nr))
+
+    # The grams are added from the lowest order, in the order of fdist, so the tables iterate in the same order
+    add_table(ngram.fdist, set_count)
+    trie.fdist = {i: TrieTable(trie, trie.nodes.get(i, []), 'count') for i in range(1, trie.n+1)}
+    trie.grams = trie.fdist
+
+    if hasattr(ngram, 'continuation_fdist'):
+        orders = list(ngram.continuation_fdist.keys())
+        add_table(ngram.continuation_fdist, set_cont_count)
+        trie.continuation_fdist = {i: TrieTable(trie, trie.nodes.get(i, []), 'cont_count') for i in orders}
+    
+    if hasattr(ngram, 'follow_fdist'):
+        orders = list(ngram.follow_fdist.keys())
+        add_table(ngram.follow_fdist, set_follow)
+        trie.follow_fdist = {i: TrieFollowTable(trie, trie.nodes.get(i, [])) for i in orders}
+    
+    for table in ['pruned_fdist', 'emission_prob', 'count_of_counts', 'smoothing'] + SMOOTHED_TABLES:
+        if hasattr(ngram, table):
+            setattr(trie, table, getattr(ngram, table))
+    
+    trie.stats = ngram.stats
+    
+    return trie
+
+
+'''
+Desc: Read-only frequency distribution, continuation frequency distribution, pruned frequency distribution or
+      smoothed table of one order of an SQLiteNGram, a column of its gram rows. Missing grams have a value of 0,
+      like nltk.FreqDist
+'''
+class SQLiteTable():
+    def __init__(self, ngram, n, column):
+        self._ngram = ngram
+        self._n = n
+        self._column = column
+        self._index = SQLITE_COLUMNS.index(column)
+        self._len = None
+        self._r_Nr = None
+    
+
+    # Run a query over the rows of the order that have a value in the column
+    def _select(self, select, order=''):
+        return self._ngram.conn.execute(f'SELECT {select} FROM gram WHERE n = ? AND {self._column} IS NOT NULL {order}', (self._n,))
+    
+
+    def get(self, key, default=None):
+        value = self._ngram.get_value(key, self._index)
+        return default if value is None else value
+    
+
+    def __getitem__(self, key):
+        value = self._ngram.get_value(key, self._index)
+        return 0 if value is None else value
+    
+
+    def __contains__(self, key):
+        return self._ngram.get_value(key, self._index) is not None
+    
+
+    def __len__(self):
+        if self._len == None:
+            self._len = self._select('COUNT(*)').fetchone()[0]
+        
+        return self._len
+    
+
+    def __iter__(self):
+        return self.keys()
+    
+
+    def keys(self):
+        return (util.str_to_tags(key) for key, in self._select('key'))
+    
+
+    def values(self):
+        return (value for value, in self._select(self._column))
+    
+
+    def items(self):
+        return ((util.str_to_tags(key), value) for key, value in self._select(f'key, {self._column}'))
+    
+
+    def most_common(self, n=None):
+        return [(util.str_to_tags(key), value) for key, value in self._select(f'key, {self._column}', f'ORDER BY {self._column} DESC LIMIT {-1 if n == None else n}')]
+    
+
+    def B(self):
+        return len(self)
+    
+
+    def N(self):
+        return self._select(f'TOTAL({self._column})').fetchone()[0]
+    
+
+    def r_Nr(self):
+        if self._r_Nr == None:
+            self._r_Nr = defaultdict(int, self._select(f'{self._column}, COUNT(*)', f'GROUP BY {self._column}').fetchall())
+            self._r_Nr[0] = 0
+        
+        return self._r_Nr
+
+
+'''
+Desc: Read-only follow (count-of-counts) table of one order of an SQLiteNGram. The count-of-counts of a gram are
+      kept in its row as a JSON list of [count, Nr] pairs
+'''
+class SQLiteFollowTable():
+    def __init__(self, ngram, n):
+        self._table = SQLiteTable(ngram, n, 'follow')
+    
+
+    def get(self, key, default=None):
+        follow = self._table.get(key)
+
+        if follow is None:
+            return default
+        
+        # Same layout as FreqDist.r_Nr()
+        r_Nr = defaultdict(int, json.loads(follow))
+        r_Nr[0] = 0
+
+        return r_Nr
+    
+
+    def __getitem__(self, key):
+        r_Nr = self.get(key)
+
+        if r_Nr is None:
+            raise KeyError(key)
+        
+        return r_Nr
+    
+
+    def __contains__(self, key):
+        return key in self._table
+    
+
+    def __len__(self):
+        return len(self._table)
+    
+
+    def __iter__(self):
+        return self._table.keys()
+    
+
+    def keys(self):
+        return self._table.keys()
+    
+
+    def items(self):
+        return ((key, self.get(key)) for key in self._table.keys())
+    
+
+    '''
+    Desc: Get the number of distinct grams following a gram without building its count-of-counts
+    In  : key (tuple)
+    Out : int
+    '''
+    def get_follow_count(self, key):
+        follow = self._table.get(key)
+        return 0 if follow is None else sum(Nr for _, Nr in json.loads(follow))
+
+
+'''
+Desc: n-gram whose tables are served from an SQLite file (see save_sqlite) instead of being decoded into memory.
+      Every gram is one row of the file, indexed by its tags and holding its value in every table, and the rows
+      looked up last are kept in a cache of cache_size rows, so the memory used does not depend on the size of the
+      model. The file is opened read-only, so processes can share it. It can not be updated, merged or pruned
+'''
+class SQLiteNGram(NGram):
+    def __init__(self, fpath, cache_size=SQLITE_CACHE_SIZE):
+        self.fpath = os.path.abspath(fpath)
+        self.cache_size = cache_size
+        self.prefix_index = {}
+        self.connect()
+    
+
+    '''
+    Desc: Open the file read-only and start with an empty row cache
+    F.S.: conn and rows initialized
+    '''
+    def connect(self):
+        self.conn = sqlite3.connect(f'file:{pathname2url(self.fpath)}?mode=ro', uri=True, check_same_thread=False)
+        self.rows = OrderedDict()
+    
+
+    # A connection can not be pickled, so a copy sent to another process opens the file again
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['conn'], state['rows']
+
+        return state
+    
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.connect()
+    
+
+    '''
+    Desc: Get the row of a gram, from the row cache or else from the file
+    In  : gram (tuple)
+    Out : tuple of the SQLITE_COLUMNS values, None if the gram is not in the file
+    '''
+    def get_row(self, gram):
+        key = util.tags_to_str(gram)
+
+        try:
+            row = self.rows[key]
+            self.rows.move_to_end(key)
+        except KeyError:
+            row = self.conn.execute(f'SELECT {", ".join(SQLITE_COLUMNS)} FROM gram WHERE key = ?', (key,)).fetchone()
+            self.rows[key] = row
+
+            if len(self.rows) > self.cache_size:
+                self.rows.popitem(last=False)
+        
+        return row
+    
+
+    '''
+    Desc: Get the value of a gram in a column of SQLITE_COLUMNS
+    In  : gram (tuple), index (int), the position of the column
+    Out : int, float, str or None if the gram has no value in the column
+    '''
+    def get_value(self, gram, index):
+        row = self.get_row(gram)
+        return None if row is None else row[index]
+    
+
+    # Only the grams of the next order starting with the gram are read, through the index of the keys
+    def get_continuations(self, gram):
+        n = len(gram)
+        assert n < self.n
+
+        prefix = util.tags_to_str(gram) + ' '
+
+        # ' ' is followed by '!', so the keys starting with prefix are between the two
+        rows = self.conn.execute('SELECT key FROM gram WHERE key >= ? AND key < ? AND n = ? AND count IS NOT NULL', (prefix, prefix[:-1] + '!', n+1))
+
+        return [util.str_to_tags(key) for key, in rows]
+    
+
+    # The follow table counts the followers without reading them
+    def get_follow_count(self, gram):
+        n = len(gram)
+        assert n < self.n
+
+        return self.follow_fdist[n].get_follow_count(gram)
+    
+
+    def get_count(self, gram):
+        assert len(gram) <= self.n
+
+        count = self.get_value(gram, 0)
+        return 0 if count is None else count
+    
+
+    def get_continuation_count(self, gram):
+        assert len(gram) < self.n
+
+        count = self.get_value(gram, 1)
+        return 0 if count is None else count
+
+
+'''
+Desc: Count every gram from unigram to n-gram in a single pass over the tokens
+In  : tokens (list), n (int), verbose (bool)
+Out : dict
+'''
+def count_ngrams(tokens, n, verbose=False):
+    start_t = time.time()
+    cp = util.ContinuousPrint()
+
+    counters = {i: Counter() for i in range(1, n+1)}
+    n_words = 0
+
+    for word_tokens in tokens:
+        # Grams of order i are the zipped i shifted views of the word
+        for i in range(1, n+1):
+            counters[i].update(zip(*[word_tokens[k:] for k in range(i)]))
+
+        n_words += 1
+
+        if verbose and n_words % 1000 == 0:
+            util.printv(verbose, 'Words: {}'.format(n_words), end='\r', cp=cp)
+    
+    util.printv(verbose, 'Words: {} | DONE in {:.2f} s'.format(n_words, time.time() - start_t))
+
+    return {i: FreqDist(counter) for i, counter in counters.items()}
+
+
+'''
+Desc: Count every gram from unigram to n-gram by splitting the tokens into shards, counting each shard
+      in a worker process and merging the partial frequency distributions
+In  : tokens (list), n (int), n_proc (int), verbose (bool)
+Out : dict
+'''
+def count_ngrams_parallel(tokens, n, n_proc, verbose=False):
+    start_t = time.time()
+    
+    # Contiguous shards, so the merged grams keep the order they are first seen in
+    shard_size = max(math.ceil(len(tokens) / n_proc), 1)
+    shards = [tokens[i:i+shard_size] for i in range(0, len(tokens), shard_size)]
+
+    util.printv(verbose, 'Counting {} shards in {} processes'.format(len(shards), n_proc))
+
+    with multiprocessing.Pool(processes=n_proc) as pool:
+        shard_fdists = pool.starmap(count_ngrams, [(shard, n) for shard in shards])
+    
+    fdist = {i: FreqDist() for i in range(1, n+1)}
+
+    for shard_fdist in shard_fdists:
+        merge_fdist(fdist, shard_fdist)
+
+    util.printv(verbose, 'Words: {} | DONE in {:.2f} s'.format(len(tokens), time.time() - start_t))
+    
+    return fdist
+
+
+'''
+Desc: Count every gram from unigram to n-gram from a stream of token chunks, counting the chunks in worker
+      processes while only a few chunks are held in memory at a time
+In  : token_chunks (iterable), n (int), n_proc (int), verbose (bool)
+Out : dict
+'''
+def count_ngrams_chunks(token_chunks, n, n_proc, verbose=False):
+    start_t = time.time()
+    cp = util.ContinuousPrint()
+
+    fdist = {i: FreqDist() for i in range(1, n+1)}
+    n_words = 0
+
+    # Merge the chunks in submission order, so the merged grams keep the order they are first seen in
+    with multiprocessing.Pool(processes=n_proc) as pool:
+        pending = deque()
+
+        for chunk in token_chunks:
+            n_words += len(chunk)
+            pending.append(pool.apply_async(count_ngrams, (chunk, n)))
+
+            if len(pending) >= 2 * n_proc:
+                merge_fdist(fdist, pending.popleft().get())
+                util.printv(verbose, 'Words: {}'.format(n_words), end='\r', cp=cp)
+        
+        while pending:
+            merge_fdist(fdist, pending.popleft().get())
+    
+    util.printv(verbose, 'Words: {} | DONE in {:.2f} s'.format(n_words, time.time() - start_t))
+
+    return fdist
+
+
+'''
+Desc: Add the counts of each frequency distribution of other_fdist into fdist
+In  : fdist (dict), other_fdist (dict)
+F.S.: fdist updated in place
+'''
+def merge_fdist(fdist, other_fdist):
+    for i, fd in other_fdist.items():
+        if i not in fdist:
+            fdist[i] = FreqDist()
+
+        fdist[i].update(fd)
+
+
+'''
+Desc: Subtract the counts of each frequency distribution of other_fdist from fdist, grams whose count
+      drops to 0 are removed
+In  : fdist (dict), other_fdist (dict)
+Out : dict
+'''
+def subtract_fdist(fdist, other_fdist):
+    return {i: fd - other_fdist[i] if i in other_fdist else fd.copy() for i, fd in fdist.items()}
+
+
+'''
+Desc: Derive the continuation and follow (count-of-counts) tables from the frequency distributions,
+      visiting each distinct gram once
+In  : fdist (dict), n (int), build_cont_fdist (bool), build_follow_fdist (bool)
+Out : tuple
+'''
+def derive_fdist(fdist, n, build_cont_fdist=True, build_follow_fdist=True):
+    continuation_fdist = {} if build_cont_fdist else None
+    follow_fdist = {} if build_follow_fdist else None
+
+    for i in range(1, n):
+        cfd = {}
+        ffd = {}
+
+        # Most common first, the iteration order of FreqDist
+        for gram, count in fdist[i+1].most_common():
+            if build_cont_fdist:
+                gram_suc = gram[1:]
+                cfd[gram_suc] = cfd.get(gram_suc, 0) + 1
+            
+            if build_follow_fdist:
+                gram_prec = gram[:-1]
+                r_Nr = ffd.get(gram_prec)
+
+                if r_Nr is None:
+                    r_Nr = ffd[gram_prec] = defaultdict(int)
+                
+                r_Nr[count] += 1
+
+        if build_cont_fdist:
+            continuation_fdist[i] = FreqDist(cfd)
+        
+        if build_follow_fdist:
+            # Same layout as FreqDist.r_Nr()
+            for r_Nr in ffd.values():
+                r_Nr[0] = 0
+
+            follow_fdist[i] = ffd
+    
+    return continuation_fdist, follow_fdist
+
+
+'''
+Desc: Count how many times each tag emits each symbol. The words and tags of the whole data train are joined
+      into two aligned strings, so the (tag, symbol) pairs are counted in one pass
+In  : data_train (pd.DataFrame), unigram_fdist (nltk.FreqDist), encode_gram (function)
+Out : dict
+'''
+def count_emission(data_train, unigram_fdist, encode_gram=lambda tags: tags):
+    words = data_train['word']
+    syms = ''.join(words)
+    tags = ''.join(syl[:len(word)] for word, syl in zip(words, data_train['syllables']))
+
+    if len(tags) != len(syms):
+        raise ValueError("Every phonemic word must be at least as long as its graphemic word")
+
+    emission_count = {}
+
+    for (tag, sym), count in Counter(zip(tags, syms)).items():
+        if unigram_fdist[encode_gram((tag,))] < 1:
+            continue
+
+        if tag not in emission_count:
+            emission_count[tag] = FreqDist()
+        
+        emission_count[tag][sym] = count
+    
+    return emission_count
+
+
+'''
+Desc: Normalize emission counts by the unigram count of each tag
+In  : emission_count (dict), unigram_fdist (nltk.FreqDist), encode_gram (function)
+Out : dict
+'''
+def normalize_emission(emission_count, unigram_fdist, encode_gram=lambda tags: tags):
+    emission_prob = {}
+
+    for tag, sym_count in emission_count.items():
+        tag_freq = unigram_fdist[encode_gram((tag,))]
+
+        if tag_freq < 1:
+            continue
+
+        emission_prob[tag] = FreqDist()
+
+        for sym, count in sym_count.items():
+            emission_prob[tag][sym] = count / tag_freq
+    
+    return emission_prob
+
+
+'''
+Desc: Process-wide cache of loaded n-grams, keyed by file, modification time and loaded tables, so a model used
+      again (e.g. for every n and B of a sweep) is only read once. A model is loaded at the highest n requested
+      and served as views for lower n. The least recently used models are evicted when the estimated size of
+      the cached models exceeds max_size (bytes)
+'''
+class Registry():
+    def __init__(self, max_size=2**31):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.hashes = {}
+        self.hits = 0
+        self.misses = 0
+    
+
+    '''
+    Desc: Get an n-gram from the cache, loading it if it is not cached yet or was cached with a lower n
+    In  : fpath (str), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool), load_emission_prob (bool),
+          load_smoothed (bool), n_load (int), the n to load the model at if it is not cached yet, trie (bool),
+          whether to cache the model as a TrieNGram
+    Out : NGram, a view up to n_max
+    '''
+    def load(self, fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False, load_smoothed=True, n_load=None, trie=False):
+        key = (os.path.abspath(fpath), os.path.getmtime(fpath), load_cont_fdist, load_follow_fdist, load_emission_prob, load_smoothed, trie)
+        entry = self.models.get(key)
+
+        # A model loaded without n_max has every order of the file
+        if entry != None and (entry['full'] or (n_max != None and n_max <= entry['ngram'].n)):
+            self.hits += 1
+            self.models.move_to_end(key)
+        else:
+            self.misses += 1
+
+            if entry != None:
+                self.evict(key)
+
+            if n_max != None and n_load != None:
+                n_load = max(n_load, n_max)
+            else:
+                n_load = n_max
+            
+            ngram = load(fpath, n_load, load_cont_fdist, load_follow_fdist, load_emission_prob, load_smoothed)
+
+            # Converted once, so only the trie is kept and the tables of the loaded n-gram are freed
+            if trie and not isinstance(ngram, (MappedNGram, SQLiteNGram)):
+                ngram = to_trie(ngram)
+
+            # A mapped or SQLite n-gram lives in the page cache, not in the process
+            size = 0 if isinstance(ngram, (MappedNGram, SQLiteNGram)) else estimate_size(ngram)
+
+            entry = self.models[key] = {'ngram': ngram, 'size': size, 'full': n_load == None}
+
+            while len(self.models) > 1 and self.get_size() > self.max_size:
+                self.evict(next(iter(self.models)))
+        
+        ngram = entry['ngram']
+
+        return ngram.view(ngram.n if n_max == None else n_max)
+    
+
+    '''
+    Desc: Get the SHA-1 hash of the content of a model file, e.g. to key the probabilities computed from it. The
+          hash is kept per file and modification time, so each file is only read once
+    In  : fpath (str)
+    Out : str
+    '''
+    def get_hash(self, fpath):
+        key = (os.path.abspath(fpath), os.path.getmtime(fpath))
+
+        if key not in self.hashes:
+            h = hashlib.sha1()
+
+            with open(fpath, mode='rb') as f:
+                for chunk in iter(lambda: f.read(2**20), b''):
+                    h.update(chunk)
+            
+            self.hashes[key] = h.hexdigest()
+        
+        return self.hashes[key]
+    
+
+    '''
+    Desc: Remove a model from the cache
+    In  : key (tuple)
+    F.S.: Model removed
+    '''
+    def evict(self, key):
+        del self.models[key]
+    
+
+    '''
+    Desc: Get the estimated size of the cached models
+    Out : int
+    '''
+    def get_size(self):
+        return sum(entry['size'] for entry in self.models.values())
+    
+
+    '''
+    Desc: Remove every model from the cache
+    F.S.: Cache emptied
+    '''
+    def clear(self):
+        self.models.clear()
+
+
+registry = Registry()
+
+
+'''
+Desc: Estimate the memory used by the tables of an n-gram, counting each key and value once
+In  : ngram (NGram)
+Out : int
+'''
+def estimate_size(ngram):
+    tables = []
+    size = 0
+
+    # The counts of a trie are held by its nodes instead of tables keyed by gram
+    if isinstance(ngram, TrieNGram):
+        for nodes in ngram.nodes.values():
+            size += sys.getsizeof(nodes)
+
+            for node in nodes:
+                size += sys.getsizeof(node) + sys.getsizeof(node.children) + sys.getsizeof(node.count) + sys.getsizeof(node.cont_count) + sys.getsizeof(node.follow)
+    else:
+        tables += list(ngram.fdist.values())
+
+        if hasattr(ngram, 'continuation_fdist'):
+            tables += list(ngram.continuation_fdist.values())
+        
+        if hasattr(ngram, 'follow_fdist'):
+            tables += list(ngram.follow_fdist.values())
+    
+    if hasattr(ngram, 'pruned_fdist'):
+        tables += list(ngram.pruned_fdist.values())
+    
+    if hasattr(ngram, 'smoothing'):
+        for table in SMOOTHED_TABLES:
+            tables += list(getattr(ngram, table).values())
+
+    for table in tables:
+        size += sys.getsizeof(table)
+
+        for k, v in table.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    
+    return size
+
+
+'''
+Desc: Encode the n-gram to JSON, or to the binary or SQLite format if binary or sqlite is set (see save_binary and
+      save_sqlite), and save it in a file. Each order of each table is written as a separate section, and an index
+      of the byte range of every section is written at the end, so load can decode only the sections it needs. The
+      file is still a plain JSON document, optionally compressed with one of COMPRESSIONS
+In  : ngram (NGram), fname (str), fdir (str), binary (bool), compression (str), sqlite (bool), quantization (str)
+Out : dict, the quantization error of a quantized binary n-gram (see save_binary), None otherwise
+'''
+def save(ngram, fname, fdir, binary=False, compression=None, sqlite=False, quantization=None):
+    if binary:
+        return save_binary(ngram, fname, fdir, quantization)
+    
+    if quantization != None:
+        raise ValueError("Only the smoothed tables of a binary n-gram can be quantized")
+    
+    if sqlite:
+        save_sqlite(ngram, fname, fdir)
+        return
+
+    fpath = f"{fdir}/{fname}.json" 
+
+    if compression != None:
+        fpath += COMPRESSIONS[compression]['ext']
+
+    index = {'N': ngram.n, 'tables': {}}
+
+    with open_model(fpath, mode='wb', compression=compression) as f:
+        # The offset of the index is written once every section is written. A compressed file can not be written
+        # back, so its offset stays 0 and the index is found from the end of the file
+        f.write(SECTIONED_HEAD + b'0' * INDEX_OFFSET_WIDTH + f'", "N": {ngram.n}'.encode('utf-8'))
+
+        # Encode a section a batch of items at a time, so the whole section is never held as one string
+        def write_section(items, encode_key=lambda k: k):
+            start = f.tell()
+            items = iter(items)
+            sep = b''
+
+            f.write(b'{')
+
+            while True:
+                batch = {encode_key(k): v for k, v in itertools.islice(items, SAVE_BATCH_SIZE)}
+
+                if not batch:
+                    break
+                
+                # Strip the braces of the encoded batch
+                f.write(sep + json.dumps(batch, ensure_ascii=False)[1:-1].encode('utf-8'))
+                sep = b', '
+            
+            f.write(b'}')
+            
+            return [start, f.tell()]
+
+        def write_tables(name, tables):
+            index['tables'][name] = {}
+            f.write(f', "{name}": {{'.encode('utf-8'))
+
+            for j, (i, table) in enumerate(tables.items()):
+                f.write(f'{", " if j > 0 else ""}"{i}": '.encode('utf-8'))
+                index['tables'][name][i] = write_section(table.items(), lambda k: util.tags_to_str(ngram.decode_gram(k)))
+            
+            f.write(b'}')
+
+        # Encode frequency distributions, one section per order
+        write_tables('fdist', ngram.fdist)
+
+        if hasattr(ngram, 'continuation_fdist'):
+            write_tables('continuation_fdist', ngram.continuation_fdist)
+        
+        if hasattr(ngram, 'follow_fdist'):
+            write_tables('follow_fdist', ngram.follow_fdist)
+        
+        if hasattr(ngram, 'pruned_fdist'):
+            write_tables('pruned_fdist', ngram.pruned_fdist)
+        
+        # Encode smoothed tables with the method and params they were computed for
+        if hasattr(ngram, 'smoothing'):
+            for table in SMOOTHED_TABLES:
+                write_tables(table, getattr(ngram, table))
+            
+            f.write(b', "smoothing": ')
+            index['tables']['smoothing'] = write_section(ngram.smoothing.items())
+        
+        # Encode emission probabilities
+        if hasattr(ngram, 'emission_prob'):
+            f.write(b', "emission_prob": ')
+            index['tables']['emission_prob'] = write_section(ngram.emission_prob.items())
+        
+        # Encode count-of-counts of a pruned n-gram
+        if hasattr(ngram, 'count_of_counts'):
+            f.write(b', "count_of_counts": ')
+            index['tables']['count_of_counts'] = write_section(ngram.count_of_counts.items())
+        
+        f.write(b', "stats": ')
+        index['tables']['stats'] = write_section(ngram.stats.items())
+        
+        # The index is the last value of the document
+        f.write(INDEX_KEY)
+        index_offset = f.tell()
+        f.write(json.dumps(index).encode('utf-8') + b'}')
+
+        if compression == None:
+            f.seek(len(SECTIONED_HEAD))
+            f.write(str(index_offset).zfill(INDEX_OFFSET_WIDTH).encode('utf-8'))
+
+
+'''
+Desc: Open an n-gram file, compressed with one of COMPRESSIONS or not. When reading, the compression is detected
+      from the first bytes of the file
+In  : fpath (str), mode (str), compression (str)
+Out : file
+'''
+def open_model(fpath, mode='rb', compression=None):
+    if mode == 'rb':
+        with open(fpath, mode='rb') as f:
+            head = f.read(8)
+        
+        for name, c in COMPRESSIONS.items():
+            if head.startswith(c['magic']):
+                compression = name
+    
+    if compression == None:
+        return open(fpath, mode=mode)
+    
+    return COMPRESSIONS[compression]['open'](fpath, mode=mode)
+
+
+'''
+Desc: Read only the sections of a sectioned n-gram file needed to load it up to n_max, laid out like the data
+      of a whole n-gram file
+In  : f (file), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool), load_emission_prob (bool),
+      load_smoothed (bool)
+Out : dict
+'''
+def read_sections(f, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False, load_smoothed=True):
+    f.seek(len(SECTIONED_HEAD))
+    index_offset = int(f.read(INDEX_OFFSET_WIDTH))
+
+    # A compressed file can not be written back, so its index is found from the last INDEX_KEY of the document.
+    # Seeking back in a compressed stream decompresses it again from the start, so the document is decompressed
+    # once into memory and its sections are read from there
+    if index_offset == 0:
+        f.seek(0)
+        f = io.BytesIO(f.read())
+        end = f.seek(0, io.SEEK_END)
+        f.seek(max(end - INDEX_SEARCH_SIZE, 0))
+        tail = f.read()
+        index = json.loads(tail[tail.rindex(INDEX_KEY) + len(INDEX_KEY):-1])
+    else:
+        f.seek(index_offset)
+        index = json.loads(f.read()[:-1])
+
+    def read_section(span):
+        f.seek(span[0])
+        return json.loads(f.read(span[1] - span[0]))
+    
+    if n_max == None:
+        n_max = index['N']
+
+    tables = ['fdist']
+
+    if load_cont_fdist:
+        tables.append('continuation_fdist')
+    
+    if load_follow_fdist:
+        tables += ['follow_fdist', 'pruned_fdist']
+    
+    if load_smoothed:
+        tables += SMOOTHED_TABLES
+    
+    data = {'N': index['N']}
+
+    for table in tables:
+        if table in index['tables']:
+            data[table] = {i: read_section(span) for i, span in index['tables'][table].items() if int(i) <= n_max}
+    
+    if load_emission_prob:
+        data['emission_prob'] = read_section(index['tables']['emission_prob'])
+    
+    if 'count_of_counts' in index['tables']:
+        data['count_of_counts'] = read_section(index['tables']['count_of_counts'])
+    
+    if 'stats' in index['tables']:
+        data['stats'] = read_section(index['tables']['stats'])
+    
+    if load_smoothed and 'smoothing' in index['tables']:
+        data['smoothing'] = read_section(index['tables']['smoothing'])
+    
+    return data
+
+
+'''
+Desc: Quantize positive values (probabilities or back-off weights) to a codebook of at most 2^bits values. Values
+      with few enough distinct values are kept exactly, otherwise the log of the values is split into 2^bits cells
+      of equal width and each value is replaced by the center of its cell, so the error of every log value is at
+      most half a cell. Only the cells holding values are kept in the codebook
+In  : values (np.ndarray), bits (int)
+Out : (np.ndarray, np.ndarray), the index of each value and the codebook
+'''
+def quantize(values, bits):
+    size = 1 << bits
+    codebook, codes = np.unique(values, return_inverse=True)
+
+    if len(codebook) <= size:
+        return codes, codebook
+    
+    logs = np.log(np.maximum(values, np.finfo(np.float64).tiny))
+    low = logs.min()
+    width = (logs.max() - low) / size
+    cells = np.minimum(((logs - low) / width).astype(np.int64), size - 1)
+    cells, codes = np.unique(cells, return_inverse=True)
+
+    return codes, np.exp(low + (cells + 0.5) * width)
+
+
+'''
+Desc: Save the n-gram in the binary format. Every table is stored as arrays of sorted packed gram keys (see Vocab)
+      and their values after a JSON header holding the vocabulary, the position of each array and the small
+      tables, so the file can be memory-mapped by load_binary without decoding it. Counts are stored in the
+      smallest unsigned type that fits them. The smoothed tables are stored as doubles, or with one of
+      QUANTIZATIONS: as floats, or as indices into a codebook of 2^16 or 2^8 values shared by every order of a
+      table (see quantize). The error of the quantized log probabilities is saved with the n-gram and returned
+In  : ngram (NGram), fname (str), fdir (str), quantization (str)
+Out : dict, the max and mean absolute log error of each quantized table, None if not quantized
+'''
+def save_binary(ngram, fname, fdir, quantization=None):
+    vocab = Vocab()
+
+    # Intern the unigram tags first so the most common tags get the smallest ids
+    for gram, _ in ngram.fdist[1].most_common():
+        vocab.get_id(ngram.decode_gram(gram)[0])
+    
+    if ngram.n * vocab.bits > 64:
+        raise ValueError(f"Can not pack {ngram.n}-grams of {vocab.bits} bits tags into 64 bits keys")
+
+    header = {
+        'N': ngram.n,
+        'bits': vocab.bits,
+        'tags': vocab.tags[1:],
+        'byteorder': sys.byteorder,
+        'tables': {}
+    }
+
+    arrays = []
+    offset = 0
+
+    def add_array(values, typecode=None):
+        nonlocal offset
+
+        # Smallest unsigned type that fits the values, or double for probabilities
+        if typecode == None and any(isinstance(v, float) for v in values):
+            typecode = 'd'
+        elif typecode == None:
+            max_value = max(values, default=0)
+            typecode = next(t for t in 'BHIQ' if max_value < 2**(8 * array(t).itemsize))
+
+        arr = array(typecode, values)
+        arrays.append((offset, arr))
+        entry = [offset, len(arr), typecode]
+        offset += align(len(arr) * arr.itemsize)
+
+        return entry
+
+    def add_tables(name, tables):
+        header['tables'][name] = {}
+
+        for i, table in tables.items():
+            items = sorted((vocab.pack(ngram.decode_gram(k)), v) for k, v in table.items())
+            header['tables'][name][i] = {
+                'keys': add_array([k for k, _ in items], 'Q'),
+                'values': add_array([v for _, v in items])
+            }
+    
+    # The values of every order are quantized together, then split back to the orders in the order of the keys
+    def add_quantized_tables(name, tables):
+        header['tables'][name] = {}
+        items = {i: sorted((vocab.pack(ngram.decode_gram(k)), v) for k, v in table.items()) for i, table in tables.items()}
+        values = np.array([v for i in items for _, v in items[i]], dtype=np.float64)
+
+        if QUANTIZATIONS[quantization] == 'f':
+            quantized = values.astype(np.float32).astype(np.float64)
+        else:
+            codes, codebook = quantize(values, QUANTIZATIONS[quantization])
+            quantized = codebook[codes]
+            header['codebooks'][name] = add_array(codebook.tolist(), 'd')
+        
+        log_error = np.abs(np.log(quantized) - np.log(values))
+        error[name] = {'max': float(log_error.max(initial=0)), 'mean': float(log_error.mean()) if len(values) else 0.0}
+        start = 0
+
+        for i, table_items in items.items():
+            end = start + len(table_items)
+
+            if QUANTIZATIONS[quantization] == 'f':
+                table_values = add_array(values[start:end].tolist(), 'f')
+            else:
+                table_values = add_array(codes[start:end].tolist(), 'B' if QUANTIZATIONS[quantization] == 8 else 'H')
+
+            header['tables'][name][i] = {
+                'keys': add_array([k for k, _ in table_items], 'Q'),
+                'values': table_values
+            }
+            start = end
+
+    add_tables('fdist', ngram.fdist)
+
+    if hasattr(ngram, 'continuation_fdist'):
+        add_tables('continuation_fdist', ngram.continuation_fdist)
+    
+    if hasattr(ngram, 'pruned_fdist'):
+        add_tables('pruned_fdist', ngram.pruned_fdist)
+    
+    error = None
+
+    if hasattr(ngram, 'smoothing'):
+        if quantization != None:
+            header['codebooks'] = {}
+            error = {}
+
+        for table in SMOOTHED_TABLES:
+            if quantization == None:
+                add_tables(table, getattr(ngram, table))
+            else:
+                add_quantized_tables(table, getattr(ngram, table))
+        
+        header['smoothing'] = ngram.smoothing
+
+        if quantization != None:
+            header['quantization'] = {'method': quantization, 'log_error': error}
+    
+    # Flatten the count-of-counts of every gram, indexed by an offset per gram
+    if hasattr(ngram, 'follow_fdist'):
+        header['tables']['follow_fdist'] = {}
+
+        for i, ffd in ngram.follow_fdist.items():
+            items = sorted((vocab.pack(ngram.decode_gram(k)), v) for k, v in ffd.items())
+            offsets = [0]
+            counts = []
+            nrs = []
+
+            for _, r_Nr in items:
+                for r, Nr in r_Nr.items():
+                    if r > 0:
+                        counts.append(r)
+                        nrs.append(Nr)
+                
+                offsets.append(len(counts))
+
+            header['tables']['follow_fdist'][i] = {
+                'keys': add_array([k for k, _ in items], 'Q'),
+                'offsets': add_array(offsets),
+                'counts': add_array(counts),
+                'nrs': add_array(nrs)
+            }
+    
+    if hasattr(ngram, 'emission_prob'):
+        header['emission_prob'] = {tag: dict(ep) for tag, ep in ngram.emission_prob.items()}
+    
+    if hasattr(ngram, 'count_of_counts'):
+        header['count_of_counts'] = ngram.count_of_counts
+    
+    header['stats'] = ngram.stats
+    
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = align(len(BINARY_MAGIC) + 8 + len(header_bytes))
+
+    # Write to file
+    fpath = f"{fdir}/{fname}.bin"
+
+    with open(fpath, mode='wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+
+        for offset, arr in arrays:
+            f.write(bytes(data_start + offset - f.tell()))
+            arr.tofile(f)
+    
+    return error
+
+
+'''
+Desc: Open an n-gram saved by save_binary. The file is memory-mapped and the tables are served from it, so
+      loading does not depend on the size of the model and processes opening the same file share its pages
+In  : fpath (str), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool), load_emission_prob (bool),
+      load_smoothed (bool)
+Out : MappedNGram
+'''
+def load_binary(fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False, load_smoothed=True):
+    with open(fpath, mode='rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    header_start = len(BINARY_MAGIC) + 8
+    header_len = int.from_bytes(mm[len(BINARY_MAGIC):header_start], 'little')
+    header = json.loads(mm[header_start:header_start+header_len].decode('utf-8'))
+    
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f"n-gram file is {header['byteorder']} endian, this machine is {sys.byteorder} endian")
+
+    data_start = align(header_start + header_len)
+    buf = memoryview(mm)
+
+    def get_array(entry):
+        offset, length, typecode = entry
+        start = data_start + offset
+
+        return buf[start:start + length * array(typecode).itemsize].cast(typecode)
+
+    def get_tables(name):
+        tables = {int(i): MappedTable(get_array(t['keys']), get_array(t['values'])) for i, t in header['tables'][name].items() if int(i) <= n_max}
+
+        # The values of a quantized table are indices into its codebook
+        if name in header.get('codebooks', {}):
+            codebook = get_array(header['codebooks'][name])
+
+            for table in tables.values():
+                table._values = CodebookArray(table._values, codebook)
+        
+        return tables
+
+    # n_max denotes max nth-gram loaded
+    if n_max == None:
+        n_max = header['N']
+    
+    assert n_max <= header['N']
+
+    ngram = MappedNGram(Vocab(header['tags'], bits=header['bits']), mm)
+    ngram.n = n_max
+    ngram.fdist = get_tables('fdist')
+    ngram.grams = ngram.fdist
+
+    if load_cont_fdist:
+        ngram.continuation_fdist = get_tables('continuation_fdist')
+    
+    if load_follow_fdist:
+        ngram.follow_fdist = {}
+
+        for i, t in header['tables']['follow_fdist'].items():
+            i = int(i)
+
+            if i > n_max:
+                continue
+
+            ngram.follow_fdist[i] = MappedFollowTable(get_array(t['keys']), get_array(t['offsets']), get_array(t['counts']), get_array(t['nrs']))
+        
+        if 'pruned_fdist' in header['tables']:
+            ngram.pruned_fdist = get_tables('pruned_fdist')
+    
+    if load_emission_prob:
+        ngram.emission_prob = {tag: FreqDist(ep) for tag, ep in header['emission_prob'].items()}
+    
+    if 'count_of_counts' in header:
+        ngram.count_of_counts = {}
+
+        for table, table_coc in header['count_of_counts'].items():
+            ngram.count_of_counts[table] = {int(i): FreqDist({int(k): v for k, v in coc.items()}) for i, coc in table_coc.items() if int(i) <= n_max}
+    
+    if load_smoothed and 'smoothing' in header:
+        for table in SMOOTHED_TABLES:
+            setattr(ngram, table, get_tables(table))
+        
+        ngram.smoothing = header['smoothing']
+
+        if 'quantization' in header:
+            ngram.quantization = header['quantization']
+    
+    # An older file has no saved statistics, they are counted once from the mapped tables
+    if 'stats' in header:
+        ngram.stats = decode_stats(header['stats'], ngram, n_max)
+    else:
+        ngram.compute_stats()
+    
+    return ngram
+
+
+'''
+Desc: Save the n-gram in an SQLite file. Every gram is one row indexed by its tags, holding its value in every
+      table, and the small tables are saved as JSON in the meta table, so load_sqlite can serve the n-gram from
+      the file without decoding it
+In  : ngram (NGram), fname (str), fdir (str)
+F.S.: n-gram saved in a file
+'''
+def save_sqlite(ngram, fname, fdir):
+    fpath = f"{fdir}/{fname}.db"
+
+    if os.path.exists(fpath):
+        os.remove(fpath)
+    
+    meta = {'N': ngram.n, 'tables': {}}
+    conn = sqlite3.connect(fpath)
+
+    try:
+        # The file is only complete once it is closed, so the journal is not needed
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+
+        with conn:
+            conn.executescript(SQLITE_TABLES_SQL)
+
+            for name, column in zip(SQLITE_TABLES, SQLITE_COLUMNS):
+                if not hasattr(ngram, name):
+                    continue
+
+                meta['tables'][name] = list(getattr(ngram, name).keys())
+
+                for i, table in getattr(ngram, name).items():
+                    items = table.items()
+
+                    if name == 'follow_fdist':
+                        items = ((k, json.dumps([[r, Nr] for r, Nr in r_Nr.items() if r > 0])) for k, r_Nr in items)
+
+                    conn.executemany(
+                        f'INSERT INTO gram (key, n, {column}) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET {column} = excluded.{column}',
+                        ((util.tags_to_str(ngram.decode_gram(k)), i, v) for k, v in items)
+                    )
+            
+            for table in ['smoothing', 'emission_prob', 'count_of_counts', 'stats']:
+                if hasattr(ngram, table):
+                    meta[table] = getattr(ngram, table)
+            
+            conn.executemany('INSERT INTO meta VALUES (?, ?)', ((k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()))
+    finally:
+        conn.close()
+
+
+'''
+Desc: Open an n-gram saved by save_sqlite. Only the small tables are read, the others are served from the file,
+      so loading does not depend on the size of the model and processes opening the same file share it
+In  : fpath (str), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool), load_emission_prob (bool),
+      load_smoothed (bool)
+Out : SQLiteNGram
+'''
+def load_sqlite(fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False, load_smoothed=True):
+    ngram = SQLiteNGram(fpath)
+    meta = {k: json.loads(v) for k, v in ngram.conn.execute('SELECT key, value FROM meta')}
+
+    # n_max denotes max nth-gram loaded
+    if n_max == None:
+        n_max = meta['N']
+    
+    assert n_max <= meta['N']
+
+    def get_tables(name):
+        return {int(i): SQLiteTable(ngram, int(i), SQLITE_COLUMNS[SQLITE_TABLES.index(name)]) for i in meta['tables'][name] if int(i) <= n_max}
+
+    ngram.n = n_max
+    ngram.fdist = get_tables('fdist')
+    ngram.grams = ngram.fdist
+
+    if load_cont_fdist:
+        ngram.continuation_fdist = get_tables('continuation_fdist')
+    
+    if load_follow_fdist:
+        ngram.follow_fdist = {int(i): SQLiteFollowTable(ngram, int(i)) for i in meta['tables']['follow_fdist'] if int(i) <= n_max}
+
+        if 'pruned_fdist' in meta['tables']:
+            ngram.pruned_fdist = get_tables('pruned_fdist')
+    
+    if load_emission_prob:
+        ngram.emission_prob = {tag: FreqDist(ep) for tag, ep in meta['emission_prob'].items()}
+    
+    if 'count_of_counts' in meta:
+        ngram.count_of_counts = {}
+
+        for table, table_coc in meta['count_of_counts'].items():
+            ngram.count_of_counts[table] = {int(i): FreqDist({int(k): v for k, v in coc.items()}) for i, coc in table_coc.items() if int(i) <= n_max}
+    
+    if load_smoothed and 'smoothing' in meta:
+        for table in SMOOTHED_TABLES:
+            setattr(ngram, table, get_tables(table))
+        
+        ngram.smoothing = meta['smoothing']
+    
+    # Statistics of a file without them are counted once from the tables in the file
+    if 'stats' in meta:
+        ngram.stats = decode_stats(meta['stats'], ngram, n_max)
+    else:
+        ngram.compute_stats()
+    
+    return ngram
+
+
+'''
+Desc: Decode the saved statistics (see NGram.compute_stats) of the tables loaded up to n_max
+In  : data (dict), ngram (NGram), n_max (int)
+Out : dict
+'''
+def decode_stats(data, ngram, n_max):
+    stats = {}
+
+    for table, table_stats in data.items():
+        if not hasattr(ngram, table):
+            continue
+
+        stats[table] = {}
+
+        for i, st in table_stats.items():
+            i = int(i)
+
+            if i > n_max:
+                continue
+
+            stats[table][i] = {'N': st['N'], 'B': st['B'], 'r_Nr': defaultdict(int, {int(k): v for k, v in st['r_Nr'].items()})}
+    
+    return stats
+
+
+'''
+Desc: Round a byte size up to a multiple of 8, so every array of a binary n-gram file is aligned
+In  : size (int)
+Out : int
+'''
+def align(size):
+    return (size + 7) // 8 * 8
+
+
+'''
+Desc: Check if a file is a binary n-gram file (see save_binary)
+In  : fpath (str)
+Out : bool
+'''
+def is_binary(fpath):
+    with open(fpath, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+'''
+Desc: Check if a file is an SQLite n-gram file (see save_sqlite)
+In  : fpath (str)
+Out : bool
+'''
+def is_sqlite(fpath):
+    with open(fpath, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+'''
+Desc: Load n-gram from a file and decode it, a binary or SQLite n-gram file is opened with load_binary or
+      load_sqlite instead.
+      Of a sectioned file (see save), only the orders up to n_max of the requested tables are read
+In  : fpath (str), n_max (int), load_cont_fdist (bool), load_follow_fdist (bool), load_emission_prob (bool),
+      load_smoothed (bool)
+Out : NGram
+'''
+def load(fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_emission_prob=False, load_smoothed=True):
+    with open_model(fpath) as f:
+        head = f.read(max(len(BINARY_MAGIC), len(SECTIONED_HEAD)))
+
+        if head.startswith(BINARY_MAGIC):
+            return load_binary(fpath, n_max, load_cont_fdist, load_follow_fdist, load_emission_prob, load_smoothed)
+        
+        if head.startswith(SQLITE_MAGIC):
+            return load_sqlite(fpath, n_max, load_cont_fdist, load_follow_fdist, load_emission_prob, load_smoothed)
+        
+        # Only the requested sections are read from a sectioned file, an older file is decoded whole
+        if head.startswith(SECTIONED_HEAD):
+            data = read_sections(f, n_max, load_cont_fdist, load_follow_fdist, load_emission_prob, load_smoothed)
+        else:
+            f.seek(0)
+            data = json.loads(f.read())
+
+    # n_max denotes max nth-gram loaded
+    if n_max == None:
+        n_max = data['N']
+    
+    assert n_max <= data['N']
+
+    ngram = NGram()
+    ngram.n = n_max
+    
+    # Decode frequency distribution
+    ngram.fdist = {}
+
+    for i, fd in data['fdist'].items():
+        i = int(i)
+        
+        if i > n_max:
+            continue 
+
+        ngram.fdist[i] = FreqDist()
+
+        for k, v in fd.items():
+            tags = util.str_to_tags(k)
+            ngram.fdist[i][tags] = int(v)
+    
+    # Decode continuation frequency distribution
+    if load_cont_fdist:
+        ngram.continuation_fdist = {}
+
+        for i, cfd in data['continuation_fdist'].items():
+            i = int(i)
+
+            if i > n_max:
+                continue 
+
+            ngram.continuation_fdist[i] = FreqDist()
+
+            for k, v in cfd.items():
+                tags = util.str_to_tags(k)
+                ngram.continuation_fdist[i][tags] = int(v)
+    
+    # Decode follow frequency distribution
+    if load_follow_fdist:
+        ngram.follow_fdist = {}
+
+        for i, ffd in data['follow_fdist'].items():
+            i = int(i)
+
+            if i > n_max:
+                continue 
+            
+            ngram.follow_fdist[i] = {}
+
+            for gram, fdist in ffd.items():
+                tags = util.str_to_tags(gram)
+                ngram.follow_fdist[i][tags] = FreqDist()
+
+                for k, v in fdist.items():
                     ngram.follow_fdist[i][tags][int(k)] = int(v)
         
     # Decode emission probabilities
@@ -352,6 +2664,58 @@ def load(fpath, n_max=None, load_cont_fdist=True, load_follow_fdist=True, load_e
             for k, v in ep.items():
                 ngram.emission_prob[tag][k] = float(v)
 
+    # Decode pruned frequency distribution, used together with the follow frequency distribution
+    if load_follow_fdist and 'pruned_fdist' in data:
+        ngram.pruned_fdist = {}
+
+        for i, pfd in data['pruned_fdist'].items():
+            i = int(i)
+
+            if i > n_max:
+                continue 
+
+            ngram.pruned_fdist[i] = FreqDist()
+
+            for k, v in pfd.items():
+                tags = util.str_to_tags(k)
+                ngram.pruned_fdist[i][tags] = int(v)
+    
+    # Decode count-of-counts of a pruned n-gram
+    if 'count_of_counts' in data:
+        ngram.count_of_counts = {}
+
+        for table, table_coc in data['count_of_counts'].items():
+            ngram.count_of_counts[table] = {}
+
+            for i, coc in table_coc.items():
+                i = int(i)
+
+                if i > n_max:
+                    continue
+
+                ngram.count_of_counts[table][i] = FreqDist({int(k): int(v) for k, v in coc.items()})
+
+    # Decode smoothed tables
+    if load_smoothed and 'smoothing' in data:
+        for table in SMOOTHED_TABLES:
+            setattr(ngram, table, {})
+
+            for i, st in data[table].items():
+                i = int(i)
+
+                if i > n_max:
+                    continue
+
+                getattr(ngram, table)[i] = {util.str_to_tags(k): float(v) for k, v in st.items()}
+        
+        ngram.smoothing = data['smoothing']
+    
+    # Statistics are counted from the tables of an older file
+    if 'stats' in data:
+        ngram.stats = decode_stats(data['stats'], ngram, n_max)
+    else:
+        ngram.compute_stats()
+
     # Get all unique grams from fdist keys
     ngram.grams = {}
 
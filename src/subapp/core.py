@@ -8,6 +8,7 @@ import utility as util
 from training.preprocess import tokenize, tokenize_g2p, pad_tokens
 from training.augmentation import flip_onsets, swap_consonants, transpose_nucleus, acronym, validate_augmentation
 from testing.syllabification import syllabify, save_result
+from testing.probability import generate_smoothed, get_cache_key, load_cache, save_cache
 from testing.stemmer import Stemmer
 
 from config import *
@@ -38,14 +39,122 @@ def get_folds_from_fnames(fnames):
         None
 
 
-def build_ngram(n_max, data_train_fnames, output_fname, output_fdir, lower_case=True, build_cont_fdist=True, build_follow_fdist=True, mode="syl", stop=lambda: False):
+def load_data_train(fname, lower_case=True):
+    data_train = pd.read_csv(
+        fname,
+        sep='\t',
+        header=None,
+        names=['word', 'syllables'],
+        na_filter=False
+    )
+
+    # Lower case words
+    if lower_case:
+        data_train["word"] = data_train["word"].str.lower()
+        data_train["syllables"] = data_train["syllables"].str.lower()
+    
+    return data_train
+
+
+def tokenize_data_train(data_train, n_max, mode="syl"):
+    if mode == "syl":
+        return pad_tokens(tokenize(data_train), n=n_max, start_pad=True, end_marker=True)
+    elif mode == "g2p":
+        return pad_tokens(tokenize_g2p(data_train), n=n_max, start_pad=True, end_marker=True)
+
+
+def stream_data_train(fname, lower_case=True, chunksize=100000):
+    reader = pd.read_csv(
+        fname,
+        sep='\t',
+        header=None,
+        names=['word', 'syllables'],
+        na_filter=False,
+        chunksize=chunksize
+    )
+
+    with reader:
+        for data_train in reader:
+            # Lower case words
+            if lower_case:
+                data_train["word"] = data_train["word"].str.lower()
+                data_train["syllables"] = data_train["syllables"].str.lower()
+
+            yield data_train
+
+
+# Count the n-gram and emission frequencies of a data train file.
+# In streaming mode the file is read in chunks, so memory is bounded by the frequency tables instead of the data.
+def count_data_train(fname, n_max, lower_case=True, mode="syl", n_proc=1, streaming=False, chunksize=100000):
+    emission_count = None
+
+    if streaming:
+        token_chunks = (tokenize_data_train(data_chunk, n_max, mode=mode) for data_chunk in stream_data_train(fname, lower_case=lower_case, chunksize=chunksize))
+
+        if n_proc > 1:
+            fdist = ngram.count_ngrams_chunks(token_chunks, n_max, n_proc, verbose=True)
+        else:
+            fdist = ngram.count_ngrams((word_tokens for tokens in token_chunks for word_tokens in tokens), n_max, verbose=True)
+        
+        # Emission counts are filtered by the unigram counts, so they need a second pass
+        if mode == "g2p":
+            emission_count = {}
+
+            for data_chunk in stream_data_train(fname, lower_case=lower_case, chunksize=chunksize):
+                ngram.merge_fdist(emission_count, ngram.count_emission(data_chunk, fdist[1]))
+    else:
+        data_train = load_data_train(fname, lower_case=lower_case)
+        tokens = tokenize_data_train(data_train, n_max, mode=mode)
+
+        if n_proc > 1:
+            fdist = ngram.count_ngrams_parallel(tokens, n_max, n_proc, verbose=True)
+        else:
+            fdist = ngram.count_ngrams(tokens, n_max, verbose=True)
+        
+        if mode == "g2p":
+            emission_count = ngram.count_emission(data_train, fdist[1])
+    
+    return fdist, emission_count
+
+
+# Print the error of the log probabilities of each quantized smoothed table, if the n-gram was quantized
+def print_quantization_error(error):
+    if error == None:
+        return
+    
+    for table, table_error in error.items():
+        print(f"Quantization error of {table}: max {table_error['max']:.6f}, mean {table_error['mean']:.6f}")
+
+
+def build_ngram(n_max, data_train_fnames, output_fname, output_fdir, lower_case=True, build_cont_fdist=True, build_follow_fdist=True, mode="syl", n_proc=1, subtract_folds=False, streaming=False, prune_args=None, smoothing_args=None, binary=False, compression=None, sqlite=False, quantization=None, stop=lambda: False):
     start_t = time.time()
 
     fold_list = get_folds_from_fnames(data_train_fnames)
     fold_mode = fold_list is not None
 
     print(f"Mode: {mode}\n")
-    print(f"Fold mode: {fold_mode}\n")
+    print(f"Fold mode: {fold_mode}")
+    print(f"n process: {n_proc}")
+    print(f"Streaming: {streaming}")
+    print(f"Pruning: {prune_args}")
+    print(f"Smoothed tables: {smoothing_args}")
+    print(f"Binary format: {binary}")
+    print(f"SQLite format: {sqlite}")
+    print(f"Quantization: {quantization}")
+    print(f"Compression: {compression}")
+
+    if fold_mode:
+        print(f"Subtract folds: {subtract_folds}")
+    
+    print()
+
+    if fold_mode and subtract_folds:
+        build_ngram_subtract_folds(n_max, data_train_fnames, fold_list, output_fname, output_fdir, lower_case=lower_case, build_cont_fdist=build_cont_fdist, build_follow_fdist=build_follow_fdist, mode=mode, n_proc=n_proc, streaming=streaming, prune_args=prune_args, smoothing_args=smoothing_args, binary=binary, compression=compression, sqlite=sqlite, quantization=quantization, stop=stop)
+
+        if not stop():
+            print("DONE in {:.2f} s".format(time.time() - start_t))
+        
+        return
 
     for i in range(len(data_train_fnames)):
         idx = fold_list[i] if fold_mode else i+1
@@ -57,28 +166,17 @@ def build_ngram(n_max, data_train_fnames, output_fname, output_fdir, lower_case=
         
         print(f'Data train: "{data_train_fnames[i]}"')
 
-        data_train = pd.read_csv(
-            data_train_fnames[i],
-            sep='\t',
-            header=None,
-            names=['word', 'syllables'],
-            na_filter=False
-        )
-
-        # Lower case words
-        if lower_case:
-            data_train["word"] = data_train["word"].str.lower()
-            data_train["syllables"] = data_train["syllables"].str.lower()
-
         # Build the n-gram
-        if mode == "syl":
-            tokens = pad_tokens(tokenize(data_train), n=n_max, start_pad=True, end_marker=True)
-            build_emission_prob = False
-        elif mode == "g2p":
-            tokens = pad_tokens(tokenize_g2p(data_train), n=n_max, start_pad=True, end_marker=True)
-            build_emission_prob = True
+        fdist, emission_count = count_data_train(data_train_fnames[i], n_max, lower_case=lower_case, mode=mode, n_proc=n_proc, streaming=streaming)
 
-        ngram_fold = ngram.NGram(tokens, n=n_max, build_cont_fdist=build_cont_fdist, build_follow_fdist=build_follow_fdist, build_emission_prob=build_emission_prob, data_train=data_train, verbose=True)
+        ngram_fold = ngram.NGram()
+        ngram_fold.generate_from_fdist(fdist, build_cont_fdist=build_cont_fdist, build_follow_fdist=build_follow_fdist, emission_count=emission_count, verbose=True)
+
+        if prune_args != None:
+            ngram_fold.prune(**prune_args, verbose=True)
+        
+        if smoothing_args != None:
+            generate_smoothed(ngram_fold, **smoothing_args, verbose=True)
 
         if stop():
             return
@@ -91,13 +189,68 @@ def build_ngram(n_max, data_train_fnames, output_fname, output_fdir, lower_case=
         elif len(data_train_fnames) > 1:
             fname += f"_{i+1}"
         
-        ngram.save(ngram_fold, fname, output_fdir)
+        error = ngram.save(ngram_fold, fname, output_fdir, binary=binary, compression=compression, sqlite=sqlite, quantization=quantization)
+        print_quantization_error(error)
         print(f'n-gram saved to "{fname}"\n')
     
     print("DONE in {:.2f} s".format(time.time() - start_t))
 
 
-def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fnames=None, lower_case=True, output_fname=None, output_fdir=None, state_elim=True, stemming=False, mode="syl", char_strips="", validation=True, save_log=True, save_result_=True, timestamp=True, stop=lambda: False):
+# Each file is a held-out partition, the model of fold k is trained on every partition except k.
+# Counts are additive, so each partition is counted once and fold k is the full counts minus partition k.
+def build_ngram_subtract_folds(n_max, data_partition_fnames, fold_list, output_fname, output_fdir, lower_case=True, build_cont_fdist=True, build_follow_fdist=True, mode="syl", n_proc=1, streaming=False, prune_args=None, smoothing_args=None, binary=False, compression=None, sqlite=False, quantization=None, stop=lambda: False):
+    partition_fdists = []
+    partition_emission_counts = []
+    full_fdist = {}
+    full_emission_count = {}
+
+    for i in range(len(data_partition_fnames)):
+        print(f"Partition {fold_list[i]} ({i+1}/{len(fold_list)})")
+        print(f'Data train: "{data_partition_fnames[i]}"')
+
+        fdist, emission_count = count_data_train(data_partition_fnames[i], n_max, lower_case=lower_case, mode=mode, n_proc=n_proc, streaming=streaming)
+
+        partition_fdists.append(fdist)
+        ngram.merge_fdist(full_fdist, fdist)
+
+        if mode == "g2p":
+            partition_emission_counts.append(emission_count)
+            ngram.merge_fdist(full_emission_count, emission_count)
+
+        if stop():
+            return
+        
+        print()
+    
+    for i in range(len(data_partition_fnames)):
+        idx = fold_list[i]
+        print(f"Fold {idx} ({i+1}/{len(fold_list)})")
+
+        fdist = ngram.subtract_fdist(full_fdist, partition_fdists[i])
+        emission_count = None
+
+        if mode == "g2p":
+            emission_count = ngram.subtract_fdist(full_emission_count, partition_emission_counts[i])
+
+        ngram_fold = ngram.NGram()
+        ngram_fold.generate_from_fdist(fdist, build_cont_fdist=build_cont_fdist, build_follow_fdist=build_follow_fdist, emission_count=emission_count, verbose=True)
+
+        if prune_args != None:
+            ngram_fold.prune(**prune_args, verbose=True)
+        
+        if smoothing_args != None:
+            generate_smoothed(ngram_fold, **smoothing_args, verbose=True)
+
+        if stop():
+            return
+        
+        fname = f"{output_fname}_fold_{idx}"
+        error = ngram.save(ngram_fold, fname, output_fdir, binary=binary, compression=compression, sqlite=sqlite, quantization=quantization)
+        print_quantization_error(error)
+        print(f'n-gram saved to "{fname}"\n')
+
+
+def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fnames=None, lower_case=True, output_fname=None, output_fdir=None, state_elim=True, stemming=False, mode="syl", char_strips="", validation=True, save_log=True, save_result_=True, timestamp=True, packed_keys=False, trie_storage=False, n_load=None, persistent_cache=False, stop=lambda: False):
     if mode == "syl":
         er_str = "ser"
         unit_str = "syllable"
@@ -105,6 +258,17 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
         er_str = "per"
         unit_str = "phoneme"
     
+    # An SQLite n-gram is read from its file as it is used. Packing it (also done to share the vocabulary of a
+    # binary n-gram) or moving it into a trie would load it whole
+    fnames = n_gram_fnames + (n_gram_aug_fnames if prob_args["with_aug"] else [])
+
+    if any(ngram.is_sqlite(fname) for fname in fnames):
+        if packed_keys or trie_storage:
+            raise ValueError("Packed keys and trie storage can not be used with SQLite n-grams")
+        
+        if any(ngram.is_binary(fname) for fname in fnames):
+            raise ValueError("SQLite n-grams can not be used together with binary n-grams")
+    
     start_t = time.time()
     result_log = {
         "metadata": {
@@ -112,6 +276,9 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
             "n": n,
             "state_elim": state_elim,
             "stemming": stemming,
+            "packed_keys": packed_keys,
+            "trie_storage": trie_storage,
+            "persistent_cache": persistent_cache,
             "prob_args": prob_args.copy()
         },
         "overall": {},
@@ -124,7 +291,17 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
     print(f"Mode: {mode}\n")
     print(f"Fold mode : {fold_mode}")
     print(f"State-elim: {state_elim}")
-    print(f"Stemming: {stemming}\n")
+    print(f"Stemming: {stemming}")
+    print(f"Packed keys: {packed_keys}")
+    print(f"Trie storage: {trie_storage}")
+    print(f"Persistent cache: {persistent_cache}\n")
+
+    # Probability caches of the main and augmented n-gram, and the n-gram each one belongs to
+    cache_n_gram_keys = {"cache": "n_gram", "cache_aug": "n_gram_aug"} if prob_args["with_aug"] else {"cache": "n_gram"}
+
+    if persistent_cache:
+        os.makedirs(f"{output_fdir}/cache", exist_ok=True)
+        cache_fpath = f"{output_fdir}/cache/prob_cache.db"
 
     if fold_mode:
         result_log["metadata"]["folds"] = str(fold_list)
@@ -156,24 +333,48 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
 
         print(f'n-gram model: "{n_gram_fnames[i]}"')
 
-        prob_args["n_gram"] = ngram.load(
+        # Models are shared through the registry, so a sweep over n and B reads each file once
+        prob_args["n_gram"] = ngram.registry.load(
             n_gram_fnames[i], 
             n_max=n, 
             load_follow_fdist=True, 
             load_cont_fdist=True,
-            load_emission_prob=True if mode == "g2p" else False
+            load_emission_prob=True if mode == "g2p" else False,
+            n_load=n_load,
+            trie=trie_storage and not packed_keys
         )
 
         if prob_args["with_aug"]:
             print(f'Aug n-gram model: "{n_gram_aug_fnames[i]}"')
 
-            prob_args["n_gram_aug"] = ngram.load(
+            prob_args["n_gram_aug"] = ngram.registry.load(
                 n_gram_aug_fnames[i],
                 n_max=n,
                 load_follow_fdist=True, 
-                load_cont_fdist=True
+                load_cont_fdist=True,
+                n_load=n_load,
+                trie=trie_storage and not packed_keys
             )
         
+        # The quantization error of the smoothed tables is logged with the error rates of the model
+        quantization = getattr(prob_args["n_gram"], "quantization", None)
+
+        # Convert the n-gram keys to packed ints, sharing one vocabulary between the main and augmented n-gram.
+        # A binary n-gram is already packed with the vocabulary of its file, so the other one is packed with it
+        n_gram_keys = ["n_gram", "n_gram_aug"] if prob_args["with_aug"] else ["n_gram"]
+        mapped = [prob_args[key] for key in n_gram_keys if isinstance(prob_args[key], ngram.MappedNGram)]
+
+        if packed_keys or mapped:
+            # A copy of the vocabulary of the mapped n-gram, so packing the other n-gram does not add its tags to the
+            # n-gram cached in the registry
+            vocab = ngram.Vocab(mapped[0].vocab.tags[1:], bits=mapped[0].vocab.bits) if mapped else ngram.Vocab()
+
+            for key in n_gram_keys:
+                if isinstance(prob_args[key], ngram.PackedNGram) and prob_args[key].vocab.tags == vocab.tags:
+                    prob_args[key].vocab = vocab
+                else:
+                    prob_args[key] = ngram.pack(prob_args[key], vocab)
+        
         if prob_args["aug_prob"]:
             config = load_config() 
             prob_args["vowels"] = list(util.str_to_tags(config["SYMBOLS"]["vowels"]))
@@ -186,8 +387,26 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
             g2p_map = G2P_DEFAULT
         
         stemmer = Stemmer() if stemming else None
+
+        # Start from the probabilities computed by earlier runs with the same model file, method and parameters
+        caches = {}
+
+        if persistent_cache:
+            cache_keys = {"cache": get_cache_key(ngram.registry.get_hash(n_gram_fnames[i]), n, prob_args)}
+
+            if prob_args["with_aug"]:
+                cache_keys["cache_aug"] = get_cache_key(ngram.registry.get_hash(n_gram_aug_fnames[i]), n, prob_args, aug=True)
+            
+            for key, n_gram_key in cache_n_gram_keys.items():
+                caches[key] = load_cache(prob_args[n_gram_key], cache_keys[key], cache_fpath, prob_args.get("cache_size"))
+                print(f"Persistent {key}: {len(caches[key])} probabilities loaded")
     
-        result = syllabify(data_test, n, prob_args, state_elim=state_elim, stemmer=stemmer, mode=mode, g2p_map=g2p_map, char_strips=char_strips, validation=validation, stop=stop)
+        result = syllabify(data_test, n, prob_args, state_elim=state_elim, stemmer=stemmer, mode=mode, g2p_map=g2p_map, char_strips=char_strips, validation=validation, stop=stop, **caches)
+
+        # Every cached probability is final, so the caches of a stopped run are saved as well
+        if persistent_cache:
+            for key, n_gram_key in cache_n_gram_keys.items():
+                save_cache(prob_args[key], prob_args[n_gram_key], cache_keys[key], cache_fpath)
 
         # Clear n_gram from memory
         prob_args['n_gram'] = None
@@ -201,6 +420,9 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
             result_log["results"][idx]["data_test"] = data_test_fnames[i]
             result_log["results"][idx]["n_gram"] = n_gram_fnames[i]
 
+            if quantization != None:
+                result_log["results"][idx]["quantization"] = quantization
+
             if prob_args["with_aug"]:
                 result_log["results"][idx]["n_gram_aug"] = n_gram_aug_fnames[i]
         
@@ -253,6 +475,7 @@ def syllabify_folds(data_test_fnames, n_gram_fnames, n, prob_args, n_gram_aug_fn
         
         print(f'Log saved to "{log_fpath}"')
     
+    print(f"Model cache: {ngram.registry.hits} hits, {ngram.registry.misses} misses, {ngram.registry.get_size() / 2**20:.2f} MB")
     print("DONE in {:.2f} s".format(end_t - start_t))
 
 
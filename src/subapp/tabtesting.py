@@ -8,6 +8,7 @@ import time
 import tkinter as tk
 import tkinter.ttk as ttk
 import style
+import ngram
 
 from tkinter.filedialog import askopenfilenames, askdirectory
 from subapp.component import FileList, FileOutput, StatusBar
@@ -64,6 +65,10 @@ class TabTesting(Tab):
         self.var_timestamp.set(True)
         self.var_no_phoneme_sym = tk.BooleanVar()
         self.var_no_phoneme_sym.set(True)
+        self.var_packed_keys = tk.BooleanVar()
+        self.var_trie_storage = tk.BooleanVar()
+        self.var_cache_size = tk.StringVar()
+        self.var_persistent_cache = tk.BooleanVar()
 
         self.sidebar()
         self.main()
@@ -187,6 +192,25 @@ class TabTesting(Tab):
         if self.mode == "g2p":
             self.cbt_no_phoneme_sym = tk.Checkbutton(self.frm_sidebar, variable=self.var_no_phoneme_sym, text="Inc. no-phoneme symbol")
             self.cbt_no_phoneme_sym.grid(columnspan=2, sticky="nw")
+
+        self.cbt_packed_keys = tk.Checkbutton(self.frm_sidebar, variable=self.var_packed_keys, text="Packed keys")
+        self.cbt_packed_keys.grid(columnspan=2, sticky="nw")
+
+        self.cbt_trie_storage = tk.Checkbutton(self.frm_sidebar, variable=self.var_trie_storage, text="Trie storage")
+        self.cbt_trie_storage.grid(columnspan=2, sticky="nw")
+
+        # Max entries of the probability cache, empty for unbounded
+        self.frm_cache_size = tk.Frame(self.frm_sidebar)
+        self.frm_cache_size.grid(columnspan=2, sticky="new")
+        self.frm_cache_size.columnconfigure(1, weight=1)
+
+        tk.Label(self.frm_cache_size, text="Cache size").grid(row=0, column=0, sticky="nw")
+
+        self.ent_cache_size = tk.Entry(self.frm_cache_size, textvariable=self.var_cache_size, width=style.DIGIT_ENTRY_WIDTH)
+        self.ent_cache_size.grid(row=0, column=1, sticky="ne")
+
+        self.cbt_persistent_cache = tk.Checkbutton(self.frm_sidebar, variable=self.var_persistent_cache, text="Persistent cache")
+        self.cbt_persistent_cache.grid(columnspan=2, sticky="nw")
     
 
     def main(self):
@@ -209,7 +233,7 @@ class TabTesting(Tab):
             master=self.frm_main,
             title="n-gram file",
             file_list=self.ngram_files,
-            file_types=[("JSON Files", "*.json"), ("All Files", "*")]
+            file_types=[("JSON Files", "*.json *.json.gz *.json.xz *.json.bz2"), ("Binary Files", "*.bin"), ("SQLite Files", "*.db"), ("All Files", "*")]
         )
         self.frm_ngram_file.grid(row=0, column=1, sticky="nsew")
         
@@ -218,7 +242,7 @@ class TabTesting(Tab):
             master=self.frm_main,
             title="Augmented n-gram file",
             file_list=self.ngram_aug_files,
-            file_types=[("JSON Files", "*.json"), ("All Files", "*")]
+            file_types=[("JSON Files", "*.json *.json.gz *.json.xz *.json.bz2"), ("Binary Files", "*.bin"), ("SQLite Files", "*.db"), ("All Files", "*")]
         )
 
         # Output area
@@ -376,6 +400,34 @@ class TabTesting(Tab):
                 self.status_bar.write("[!] Alpha is not a valid decimal number\n")
                 valid = False
         
+        self.cache_size = None
+
+        try:
+            if self.var_cache_size.get() != '':
+                self.cache_size = int(self.var_cache_size.get())
+
+                if self.cache_size < 1:
+                    self.status_bar.write("[!] Cache size can not be smaller than 1\n")
+                    valid = False
+        except ValueError:
+            self.status_bar.write("[!] Cache size is not a valid integer number\n")
+            valid = False
+        
+        if self.var_packed_keys.get() and self.var_trie_storage.get():
+            self.status_bar.write("[!] Packed keys and trie storage can not be used together.\n")
+            valid = False
+        
+        ngram_files = [fname for fname in self.ngram_files + (self.ngram_aug_files if self.var_augmentation.get() else []) if os.path.isfile(fname)]
+
+        if any(ngram.is_sqlite(fname) for fname in ngram_files):
+            if self.var_packed_keys.get() or self.var_trie_storage.get():
+                self.status_bar.write("[!] Packed keys and trie storage can not be used with SQLite n-gram files.\n")
+                valid = False
+            
+            if any(ngram.is_binary(fname) for fname in ngram_files):
+                self.status_bar.write("[!] SQLite and binary n-gram files can not be used together.\n")
+                valid = False
+        
         if len(self.test_files) < 1:
             self.status_bar.write("[!] No test file selected.\n")
             valid = False
@@ -392,8 +444,8 @@ class TabTesting(Tab):
             self.status_bar.write("[!] Number of test file and augmented n-gram file does not match.\n")
             valid = False
         
-        if self.var_save_log.get() or self.var_save_result.get():
-            if self.var_output_fname.get() == '':
+        if self.var_save_log.get() or self.var_save_result.get() or self.var_persistent_cache.get():
+            if (self.var_save_log.get() or self.var_save_result.get()) and self.var_output_fname.get() == '':
                 self.status_bar.write("[!] File name can not be empty.\n")
                 valid = False
             
@@ -438,7 +490,8 @@ class TabTesting(Tab):
                     "aug_prob_methods": {
                         "flip_onsets": self.var_aug_prob_flip.get(),
                         "transpose_nucleus": self.var_aug_prob_transpose.get()
-                    }
+                    },
+                    "cache_size": self.cache_size
                 }
 
                 if self.var_augmentation.get():
@@ -469,6 +522,10 @@ class TabTesting(Tab):
                         save_log=self.var_save_log.get(),
                         save_result_=self.var_save_result.get(),
                         timestamp=self.var_timestamp.get(),
+                        packed_keys=self.var_packed_keys.get(),
+                        trie_storage=self.var_trie_storage.get(),
+                        n_load=max(self.n_range),
+                        persistent_cache=self.var_persistent_cache.get(),
                         stop=stop
                     )
                 except Exception as e:
@@ -6,12 +6,20 @@ import os.path
 import threading
 import time
 import tkinter as tk
+import tkinter.ttk as ttk
 import style
 
 from tkinter.filedialog import askopenfilenames, askdirectory
 from subapp.component import FileList, FileOutput, StatusBar
 from subapp.core import build_ngram
 
+# Smoothing method key, param key, param label and default value of the smoothed tables
+SMOOTHED_TABLES_PARAMS = {
+    "GKN": ("gkn", "d_ceil", "B", 3),
+    "KN": ("kn", "d", "D", 0.75),
+    "Stupid Backoff": ("stupid_backoff", "alpha", "Alpha", 0.4)
+}
+
 class TabTraining(Tab):
     def __init__(self, master):
         super().__init__(master)
@@ -29,6 +37,22 @@ class TabTraining(Tab):
         self.var_cont_count.set(True)
         self.var_follow_count = tk.BooleanVar()
         self.var_follow_count.set(True)
+        self.var_n_proc = tk.IntVar()
+        self.var_n_proc.set(1)
+        self.var_subtract_folds = tk.BooleanVar()
+        self.var_streaming = tk.BooleanVar()
+        self.var_pruning = tk.BooleanVar()
+        self.var_prune_criterion = tk.StringVar()
+        self.var_prune_threshold = tk.StringVar()
+        self.var_prune_threshold.set(2)
+        self.var_prune_max_size = tk.StringVar()
+        self.var_smoothed = tk.BooleanVar()
+        self.var_smoothed_method = tk.StringVar()
+        self.var_smoothed_param = tk.StringVar()
+        self.var_binary = tk.BooleanVar()
+        self.var_compression = tk.StringVar()
+        self.var_sqlite = tk.BooleanVar()
+        self.var_quantization = tk.StringVar()
         
         self.sidebar()
         self.main()
@@ -52,6 +76,101 @@ class TabTraining(Tab):
         self.cbt_follow_count = tk.Checkbutton(self.frm_sidebar, variable=self.var_follow_count, text="Follow count")
         self.cbt_follow_count.grid(row=3, column=0, columnspan=2, sticky="nw")
 
+        tk.Label(self.frm_sidebar, text="Processes").grid(row=4, column=0, sticky="nw")
+
+        self.sbx_n_proc = tk.Spinbox(self.frm_sidebar, textvariable=self.var_n_proc, from_=1, to=64, width=style.DIGIT_ENTRY_WIDTH)
+        self.sbx_n_proc.grid(row=4, column=1, sticky="ne")
+
+        self.cbt_subtract_folds = tk.Checkbutton(self.frm_sidebar, variable=self.var_subtract_folds, text="Subtract folds")
+        self.cbt_subtract_folds.grid(row=5, column=0, columnspan=2, sticky="nw")
+
+        self.cbt_streaming = tk.Checkbutton(self.frm_sidebar, variable=self.var_streaming, text="Streaming")
+        self.cbt_streaming.grid(row=6, column=0, columnspan=2, sticky="nw")
+
+        # Pruning params
+        self.cbt_pruning = tk.Checkbutton(self.frm_sidebar, variable=self.var_pruning, command=self.toggle_pruning, text="Pruning")
+        self.cbt_pruning.grid(row=7, column=0, columnspan=2, sticky="nw")
+
+        self.frm_pruning = tk.Frame(self.frm_sidebar)
+        self.frm_pruning.columnconfigure(1, weight=1)
+
+        self.cbx_prune_criterion = ttk.Combobox(
+            self.frm_pruning,
+            state="readonly",
+            textvariable=self.var_prune_criterion,
+            values=["Count", "Entropy"],
+            width=15
+        )
+        self.cbx_prune_criterion.set("Count")
+        self.cbx_prune_criterion.grid(row=0, column=0, columnspan=2, sticky="new")
+
+        tk.Label(self.frm_pruning, text="Threshold").grid(row=1, column=0, sticky="nw")
+
+        self.ent_prune_threshold = tk.Entry(self.frm_pruning, textvariable=self.var_prune_threshold, width=style.DIGIT_ENTRY_WIDTH)
+        self.ent_prune_threshold.grid(row=1, column=1, sticky="ne")
+
+        tk.Label(self.frm_pruning, text="Max size (MB)").grid(row=2, column=0, sticky="nw")
+
+        self.ent_prune_max_size = tk.Entry(self.frm_pruning, textvariable=self.var_prune_max_size, width=style.DIGIT_ENTRY_WIDTH)
+        self.ent_prune_max_size.grid(row=2, column=1, sticky="ne")
+
+        # Smoothed tables params
+        self.cbt_smoothed = tk.Checkbutton(self.frm_sidebar, variable=self.var_smoothed, command=self.toggle_smoothed, text="Smoothed tables")
+        self.cbt_smoothed.grid(row=9, column=0, columnspan=2, sticky="nw")
+
+        self.frm_smoothed = tk.Frame(self.frm_sidebar)
+        self.frm_smoothed.columnconfigure(1, weight=1)
+
+        self.cbx_smoothed_method = ttk.Combobox(
+            self.frm_smoothed,
+            state="readonly",
+            textvariable=self.var_smoothed_method,
+            values=list(SMOOTHED_TABLES_PARAMS.keys()),
+            width=15
+        )
+        self.cbx_smoothed_method.bind("<<ComboboxSelected>>", self.cbx_smoothed_method_changed)
+        self.cbx_smoothed_method.set("GKN")
+        self.cbx_smoothed_method.grid(row=0, column=0, columnspan=2, sticky="new")
+
+        self.lbl_smoothed_param = tk.Label(self.frm_smoothed)
+        self.lbl_smoothed_param.grid(row=1, column=0, sticky="nw")
+
+        self.ent_smoothed_param = tk.Entry(self.frm_smoothed, textvariable=self.var_smoothed_param, width=style.DIGIT_ENTRY_WIDTH)
+        self.ent_smoothed_param.grid(row=1, column=1, sticky="ne")
+
+        self.cbx_smoothed_method_changed(None)
+
+        self.cbt_binary = tk.Checkbutton(self.frm_sidebar, variable=self.var_binary, text="Binary format")
+        self.cbt_binary.grid(row=11, column=0, columnspan=2, sticky="nw")
+
+        tk.Label(self.frm_sidebar, text="Compression").grid(row=12, column=0, sticky="nw")
+
+        self.cbx_compression = ttk.Combobox(
+            self.frm_sidebar,
+            state="readonly",
+            textvariable=self.var_compression,
+            values=["None", "gzip", "xz", "bz2"],
+            width=6
+        )
+        self.cbx_compression.set("None")
+        self.cbx_compression.grid(row=12, column=1, sticky="ne")
+
+        self.cbt_sqlite = tk.Checkbutton(self.frm_sidebar, variable=self.var_sqlite, text="SQLite format")
+        self.cbt_sqlite.grid(row=13, column=0, columnspan=2, sticky="nw")
+
+        # Storage of the smoothed tables of a binary model
+        tk.Label(self.frm_sidebar, text="Quantization").grid(row=14, column=0, sticky="nw")
+
+        self.cbx_quantization = ttk.Combobox(
+            self.frm_sidebar,
+            state="readonly",
+            textvariable=self.var_quantization,
+            values=["None", "float32", "codebook16", "codebook8"],
+            width=10
+        )
+        self.cbx_quantization.set("None")
+        self.cbx_quantization.grid(row=14, column=1, sticky="ne")
+
     
     def main(self):
         self.frm_main = tk.Frame(self)
@@ -89,6 +208,27 @@ class TabTraining(Tab):
         self.btn_cancel.grid(row=0, column=0, sticky="e", padx=style.ELEMENT_PADDING)
     
 
+    def toggle_pruning(self):
+        if self.var_pruning.get():
+            self.frm_pruning.grid(row=8, column=0, columnspan=2, sticky="new")
+        else:
+            self.frm_pruning.grid_remove()
+    
+
+    def toggle_smoothed(self):
+        if self.var_smoothed.get():
+            self.frm_smoothed.grid(row=10, column=0, columnspan=2, sticky="new")
+        else:
+            self.frm_smoothed.grid_remove()
+    
+
+    def cbx_smoothed_method_changed(self, event):
+        _, _, label, default = SMOOTHED_TABLES_PARAMS[self.cbx_smoothed_method.get()]
+
+        self.lbl_smoothed_param.config(text=label)
+        self.var_smoothed_param.set(default)
+
+
     def status_bar(self):
         self.status_bar = StatusBar(self)
         self.status_bar.grid(row=1, column=0, columnspan=2, sticky="nsew", padx=style.SECTION_PADDING, pady=style.SECTION_PADDING)
@@ -107,6 +247,10 @@ class TabTraining(Tab):
             self.status_bar.write("[!] No train file selected.\n")
             valid = False
         
+        if self.var_binary.get() and self.var_sqlite.get():
+            self.status_bar.write("[!] Binary format and SQLite format can not be used together.\n")
+            valid = False
+        
         if self.var_output_fname.get() == '':
             self.status_bar.write("[!] File name can not be empty.\n")
             valid = False
@@ -118,6 +262,42 @@ class TabTraining(Tab):
             self.status_bar.write("[!] Directory is not exists/valid.\n")
             valid = False
         
+        self.prune_args = None
+
+        if self.var_pruning.get():
+            self.prune_args = {"criterion": self.var_prune_criterion.get().lower()}
+
+            # An empty field means no limit
+            try:
+                if self.var_prune_threshold.get() != '':
+                    self.prune_args["threshold"] = float(self.var_prune_threshold.get())
+            except ValueError:
+                self.status_bar.write("[!] Threshold is not a valid decimal number\n")
+                valid = False
+            
+            try:
+                if self.var_prune_max_size.get() != '':
+                    self.prune_args["max_size"] = int(float(self.var_prune_max_size.get()) * 2**20)
+            except ValueError:
+                self.status_bar.write("[!] Max size is not a valid decimal number\n")
+                valid = False
+        
+        self.smoothing_args = None
+
+        if self.var_smoothed.get():
+            method, param, label, _ = SMOOTHED_TABLES_PARAMS[self.var_smoothed_method.get()]
+
+            try:
+                value = int(self.var_smoothed_param.get()) if method == "gkn" else float(self.var_smoothed_param.get())
+                self.smoothing_args = {"method": method, param: value}
+            except ValueError:
+                self.status_bar.write(f"[!] {label} is not a valid {'integer' if method == 'gkn' else 'decimal number'}\n")
+                valid = False
+        
+        if self.var_quantization.get() != "None" and not (self.var_binary.get() and self.var_smoothed.get()):
+            self.status_bar.write("[!] Quantization needs Binary format and Smoothed tables.\n")
+            valid = False
+        
         self.status_bar.write("\n")
 
         if valid:
@@ -148,6 +328,15 @@ class TabTraining(Tab):
                 build_cont_fdist=self.var_cont_count.get(),
                 build_follow_fdist=self.var_follow_count.get(),
                 mode=self.mode,
+                n_proc=int(self.var_n_proc.get()),
+                subtract_folds=self.var_subtract_folds.get(),
+                streaming=self.var_streaming.get(),
+                prune_args=self.prune_args,
+                smoothing_args=self.smoothing_args,
+                binary=self.var_binary.get(),
+                compression=None if self.var_compression.get() == "None" else self.var_compression.get(),
+                sqlite=self.var_sqlite.get(),
+                quantization=None if self.var_quantization.get() == "None" else self.var_quantization.get(),
                 stop=stop
             )
         except Exception as e:
@@ -1,42 +1,84 @@
+import functools
 import json
+import ngram
+import numpy as np
+import os.path
+import sqlite3
 import utility as util
+from collections import OrderedDict
 from nltk.probability import FreqDist
 
 from training.augmentation import flip_onsets_word, transpose_nucleus_word
 
+CACHE_TABLES_SQL = '''
+    CREATE TABLE IF NOT EXISTS cache_key (id INTEGER PRIMARY KEY, key TEXT UNIQUE);
+    CREATE TABLE IF NOT EXISTS prob_cache (key_id INTEGER, level TEXT, tags TEXT, prob REAL, PRIMARY KEY (key_id, level, tags)) WITHOUT ROWID;
+'''
+CACHE_KEY_PARAMS = {'gkn': 'd_ceil', 'kn': 'd', 'stupid_backoff': 'alpha'}
+AUG_WORD_CACHE_SIZE = 2**16
+
+
 '''
 Desc: Get the probability of a tag sqeuence from an n-gram with kneser-ney smoothing
-In  : tags (tuple), n_gram (NGram), d (float), highest_order (bool)
+In  : tags (tuple), n_gram (NGram), d (float), highest_order (bool), cache (ProbCache)
 Out : float
 '''
-def kn(tags, n_gram, d=0.75, highest_order=True):
-    n = len(tags)
+def kn(tags, n_gram, d=0.75, highest_order=True, cache=None):
+    n = n_gram.get_order(tags)
+
+    # Key used to access cache
+    ckey = 'top' if highest_order else 'low'
+
+    # Attempt to get probability from cache
+    if cache != None:
+        prob = cache.get(ckey, tags)
+
+        if prob != None:
+            return prob
     
     # For unigram
     if n == 1:
-        return max(n_gram.get_continuation_count(tags), 1) / n_gram.get_fdist(2).B()
+        prob = max(n_gram.get_continuation_count(tags), 1) / n_gram.get_type_count(2)
     
     # For bigram and higher
-    tags_prec  = tags[:-1]
-    count_prec = n_gram.get_count(tags_prec)
-    
-    if highest_order:
-        # Raw count of tag sequence
-        ckn      = n_gram.get_count(tags)
-        ckn_prec = count_prec
     else:
-        # Continuation count of tag sequence
-        ckn      = n_gram.get_continuation_count(tags)
-        ckn_prec = n_gram.get_continuation_count(tags_prec)
+        tags_prec  = n_gram.get_prec(tags)
+        count_prec = n_gram.get_count(tags_prec)
+        
+        if highest_order:
+            # Raw count of tag sequence
+            ckn      = n_gram.get_count(tags)
+            ckn_prec = count_prec
+        else:
+            # Continuation count of tag sequence
+            ckn      = n_gram.get_continuation_count(tags)
+            ckn_prec = n_gram.get_continuation_count(tags_prec)
+        
+        if count_prec == 0:
+            prob = kn(n_gram.get_backoff(tags), n_gram, d=d, highest_order=True, cache=cache)
+        else:
+            # Normalizing constant (lambda)
+            L = kn_lambda(tags_prec, count_prec, n_gram, d=d)
+            
+            # Main formula
+            prob = (max(ckn-d, 0) / max(ckn_prec, 1)) + L * kn(n_gram.get_backoff(tags), n_gram, d=d, highest_order=False, cache=cache)
     
-    if count_prec == 0:
-        return kn(tags[1:], n_gram, d=d, highest_order=True)
+    if cache != None:
+        cache.put(ckey, tags, prob)
     
-    # Normalizing constant (lambda)
+    return prob
+
+
+'''
+Desc: Get the normalizing constant (lambda) of a context in kn
+In  : tags_prec (tuple), count_prec (int), n_gram (NGram), d (float)
+Out : float
+'''
+def kn_lambda(tags_prec, count_prec, n_gram, d=0.75):
     L = (d / max(count_prec, 1)) * max(n_gram.get_follow_count(tags_prec), 1)
-    
-    # Main formula
-    return (max(ckn-d, 0) / max(ckn_prec, 1)) + L * kn(tags[1:], n_gram, d=d, highest_order=False)
+    L += n_gram.get_pruned_count(tags_prec) / max(count_prec, 1)
+
+    return L
 
 
 '''
@@ -45,13 +87,9 @@ In  : tags (tuple), n_gram (NGram), ceil (int)
 Out : defaultdict
 '''
 def follow_count_dist(tags, n_gram, ceil=3):
-    n = len(tags) + 1
-    assert n <= n_gram.N()
-    
     fdist = FreqDist()
-    for grams in n_gram.get_fdist(n):
-        if grams[:-1] == tags:
-            fdist[grams[-1]] = n_gram.get_count(grams)
+    for grams in n_gram.get_continuations(tags):
+        fdist[grams] = n_gram.get_count(grams)
     fdist_c = fdist.r_Nr()
     fdist_c_keys = list(fdist_c.keys())
 
@@ -89,10 +127,7 @@ def gkn_discount(n_gram, n, c, ceil=3, highest_order=True):
     if c == 0:
         return 0
     
-    if highest_order:
-        c_freq = n_gram.get_fdist(n).r_Nr()
-    else:
-        c_freq = n_gram.get_continuation_fdist(n).r_Nr()
+    c_freq = n_gram.get_count_of_counts(n, continuation=not highest_order)
     
     c = min(c, ceil)
     try:
@@ -103,39 +138,81 @@ def gkn_discount(n_gram, n, c, ceil=3, highest_order=True):
     return max(d, 0)
 
 
+'''
+Desc: Get the normalizing constant (lambda) of a context in gkn
+In  : tags_prec (tuple), count_prec (int), n_gram (NGram), d_ceil (int), d_cache (dict), highest_order (bool)
+Out : float, None if the context is not followed by any gram and gkn backs off
+'''
+def gkn_lambda(tags_prec, count_prec, n_gram, d_ceil=3, d_cache=None, highest_order=True):
+    if count_prec == 0:
+        return None
+    
+    n = n_gram.get_order(tags_prec) + 1
+
+    # Constant to ensure the distribution sums to 1
+    #fc_dist = follow_count_dist(tags_prec, n_gram, ceil=d_ceil)
+    fc_dist = cut_follow_fdist(n_gram.get_follow_fdist(tags_prec), ceil=d_ceil)
+
+    if len(fc_dist.keys()) <= 1:
+        return None
+    
+    gamma = 0
+    for i in range(1, d_ceil+1):
+        if d_cache != None:
+            gamma += d_cache[n][i] * fc_dist[i] 
+        else:
+            gamma += gkn_discount(n_gram, n, i, d_ceil, highest_order) * fc_dist[i] 
+
+    # Mass of the pruned grams following the context
+    gamma += n_gram.get_pruned_count(tags_prec)
+
+    return gamma / count_prec
+
+
 '''
 Desc: Get the probability of a tag sqeuence from an n-gram with generalized kneser-ney smoothing
-In  : tags (tuple), n_gram (NGram), d_ceil (int), w (int), cache (dict), d_cache (dict), highest_order (bool)
+In  : tags (tuple), n_gram (NGram), d_ceil (int), w (int), cache (ProbCache), d_cache (dict), l_cache (dict),
+      highest_order (bool)
 Out : float
 '''
-def gkn(tags, n_gram, d_ceil=3, w=1, cache=None, d_cache=None, highest_order=True):
-    n = len(tags)
+def gkn(tags, n_gram, d_ceil=3, w=1, cache=None, d_cache=None, l_cache=None, highest_order=True):
+    n = n_gram.get_order(tags)
     
     # Key used to access cache
     ckey = 'top' if highest_order else 'low'
     
     # Attempt to get probability from cache
-    if cache != None and tags in cache[ckey][n]:
-        return cache[ckey][n][tags]
+    if cache != None:
+        weighted_prob = cache.get(ckey, tags)
+
+        if weighted_prob != None:
+            return weighted_prob
     
     # For unigram
     if n == 1:
-        prob = max(n_gram.get_continuation_count(tags), 1) / n_gram.get_fdist(2).B()
+        prob = max(n_gram.get_continuation_count(tags), 1) / n_gram.get_type_count(2)
     
     # For bigram and higher
     else:
-        tags_prec  = tags[:-1]
+        tags_prec  = n_gram.get_prec(tags)
         count      = n_gram.get_count(tags)
         count_prec = n_gram.get_count(tags_prec)
 
-        # Constant to ensure the distribution sums to 1
-        if count_prec > 0:
-            #fc_dist = follow_count_dist(tags_prec, n_gram, ceil=d_ceil)
-            fc_dist = cut_follow_fdist(n_gram.get_follow_fdist(tags_prec), ceil=d_ceil)
+        # Normalizing constant (lambda)
+        if l_cache != None:
+            L = l_cache[n-1].get(tags_prec)
+        else:
+            L = gkn_lambda(tags_prec, count_prec, n_gram, d_ceil=d_ceil, d_cache=d_cache, highest_order=highest_order)
+
+        # If context count is 0 or fc_dist is 0, back-off to lower order n-gram. The probability is cached for
+        # the tags as well, so a warm cache does not repeat the back-off
+        if L == None:
+            weighted_prob = gkn(n_gram.get_backoff(tags), n_gram, d_ceil=d_ceil, w=w, cache=cache, d_cache=d_cache, l_cache=l_cache)
 
-        # If context count is 0 or fc_dist is 0, back-off to lower order n-gram
-        if count_prec == 0 or len(fc_dist.keys()) <= 1:
-            return gkn(tags[1:], n_gram, d_ceil=d_ceil, w=w, cache=cache, d_cache=d_cache) 
+            if cache != None:
+                cache.put(ckey, tags, weighted_prob)
+            
+            return weighted_prob
 
         if highest_order:
             # Raw count of tag sequence
@@ -152,58 +229,201 @@ def gkn(tags, n_gram, d_ceil=3, w=1, cache=None, d_cache=None, highest_order=Tru
         else:
             D = gkn_discount(n_gram, n, ckn, d_ceil, highest_order)
 
-
-        gamma = 0
-        for i in range(1, d_ceil+1):
-            if d_cache != None:
-                gamma += d_cache[n][i] * fc_dist[i] 
-            else:
-                gamma += gkn_discount(n_gram, n, i, d_ceil, highest_order) * fc_dist[i] 
-
-        # Normalizing constant (lambda)
-        L = gamma / count_prec
-
         # Main formula
-        prob = (max(ckn-D, 0)/ckn_prec) + L*gkn(tags[1:], n_gram, d_ceil=d_ceil, w=w, cache=cache, d_cache=d_cache, highest_order=False) 
+        prob = (max(ckn-D, 0)/ckn_prec) + L*gkn(n_gram.get_backoff(tags), n_gram, d_ceil=d_ceil, w=w, cache=cache, d_cache=d_cache, l_cache=l_cache, highest_order=False) 
     
     weighted_prob = prob * w
     if cache != None:
-        cache[ckey][n][tags] = weighted_prob
+        cache.put(ckey, tags, weighted_prob)
 
     return weighted_prob
 
 
 '''
 Desc: Get the probability of a tag sqeuence from an n-gram with stupid backoff smoothing
-In  : tags (tuple), n_gram (NGram), alpha (float), cache (dict)
+In  : tags (tuple), n_gram (NGram), alpha (float), cache (ProbCache)
 Out : float
 '''
 def stupid_backoff(tags, n_gram, alpha=0.4, cache=None):
-    n = len(tags)
+    n = n_gram.get_order(tags)
 
     # Check the cache if the probability of the tags already exists
-    if cache != None and tags in cache['top'][n]:
-        return cache['top'][n][tags]
+    if cache != None:
+        prob = cache.get('top', tags)
+
+        if prob != None:
+            return prob
 
     count = n_gram.get_count(tags)
 
     if count > 0 and n >= 2:
-        tags_prec = tags[:-1]
+        tags_prec = n_gram.get_prec(tags)
         count_prec = n_gram.get_count(tags_prec)
         prob = count / count_prec
     elif n >= 2:
-        prob = alpha * stupid_backoff(tags[1:], n_gram, alpha=alpha)
+        prob = alpha * stupid_backoff(n_gram.get_backoff(tags), n_gram, alpha=alpha, cache=cache)
     else:
         # Unigram probability
-        prob = n_gram.get_count(tags) / n_gram.get_fdist(1).N()
+        prob = n_gram.get_count(tags) / n_gram.get_total_count(1)
     
     # Store the probability to the cache
     if cache != None:
-        cache['top'][n][tags] = prob
+        cache.put('top', tags, prob)
     
     return prob
 
 
+'''
+Desc: Get the probability of a tag sequence from the smoothed tables of an n-gram (see generate_smoothed), a
+      lookup followed by at most one back-off weight per order
+In  : tags (tuple), n_gram (NGram), highest_order (bool)
+Out : float
+'''
+def smoothed(tags, n_gram, highest_order=True):
+    n = n_gram.get_order(tags)
+
+    # Lower orders reached by the back-off of kn and gkn have their own probabilities
+    if highest_order or n == 1:
+        prob = n_gram.smoothed_prob[n].get(tags)
+    else:
+        prob = n_gram.smoothed_low_prob[n].get(tags)
+    
+    if prob != None:
+        return prob
+    
+    # Unseen unigram
+    if n == 1:
+        return n_gram.smoothing['unk']
+    
+    backoff = n_gram.get_backoff(tags)
+
+    if n_gram.smoothing['method'] == 'stupid_backoff':
+        return n_gram.smoothing['params']['alpha'] * smoothed(backoff, n_gram)
+    
+    L = n_gram.backoff_weight[n-1].get(n_gram.get_prec(tags))
+
+    # A context without a weight is not followed by any gram, back-off like kn and gkn do
+    if L == None:
+        return smoothed(backoff, n_gram)
+    
+    return L * smoothed(backoff, n_gram, highest_order=False)
+
+
+'''
+Desc: Get the smoothed tables of a packed n-gram as sorted arrays (see ngram.table_arrays), built once per n-gram
+In  : n_gram (PackedNGram)
+Out : dict
+'''
+def get_smoothed_arrays(n_gram):
+    arrays = getattr(n_gram, 'smoothed_arrays', None)
+
+    if arrays == None:
+        arrays = {table: {i: ngram.table_arrays(t) for i, t in getattr(n_gram, table).items()} for table in ngram.SMOOTHED_TABLES}
+        n_gram.smoothed_arrays = arrays
+    
+    return arrays
+
+
+'''
+Desc: Look up packed keys in a table of sorted arrays
+In  : table (tuple), keys (np.ndarray)
+Out : (np.ndarray, np.ndarray), whether each key exists and its value (arbitrary if it does not)
+'''
+def lookup_batch(table, keys):
+    table_keys, table_values = table
+
+    if len(table_keys) == 0:
+        return np.zeros(len(keys), dtype=bool), np.zeros(len(keys))
+    
+    idx = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+
+    return table_keys[idx] == keys, table_values[idx]
+
+
+'''
+Desc: Vectorized smoothed (see smoothed) over a batch of packed grams. The grams of each order are looked up together,
+      then the unresolved ones are backed off together, one order per round. The weights of the rounds are applied
+      from the last one, in the order of the recursion of smoothed, so the probabilities are the same
+In  : grams (list), n_gram (PackedNGram)
+Out : np.ndarray
+'''
+def smoothed_batch(grams, n_gram):
+    arrays = get_smoothed_arrays(n_gram)
+    bits = np.uint64(n_gram.bits)
+
+    keys = np.fromiter(grams, dtype=np.uint64, count=len(grams))
+    orders = np.zeros(len(keys), dtype=np.int64)
+
+    for i in range(n_gram.N()):
+        orders += (keys >> (np.uint64(i) * bits)) > 0
+    
+    probs = np.zeros(len(keys))
+
+    for n in np.unique(orders).tolist():
+        batch = np.flatnonzero(orders == n)
+        batch_keys = keys[batch]
+        batch_probs = np.zeros(len(batch))
+        low = np.zeros(len(batch), dtype=bool)
+        active = np.arange(len(batch))
+        weights = []
+
+        for i in range(n, 0, -1):
+            k, l = batch_keys[active], low[active]
+            found, prob = lookup_batch(arrays['smoothed_prob'][i], k)
+
+            # Lower orders reached by the back-off of kn and gkn have their own probabilities
+            if i > 1 and l.any():
+                found_low, prob_low = lookup_batch(arrays['smoothed_low_prob'][i], k)
+                found = np.where(l, found_low, found)
+                prob = np.where(l, prob_low, prob)
+            
+            # Unseen unigram
+            if i == 1:
+                prob[~found] = n_gram.smoothing['unk']
+                found[:] = True
+            
+            batch_probs[active[found]] = prob[found]
+            active, k = active[~found], k[~found]
+
+            if not active.size:
+                break
+
+            weight = np.ones(len(batch))
+
+            if n_gram.smoothing['method'] == 'stupid_backoff':
+                weight[active] = n_gram.smoothing['params']['alpha']
+            else:
+                found_L, L = lookup_batch(arrays['backoff_weight'][i-1], k & np.uint64((1 << (i-1) * n_gram.bits) - 1))
+
+                # A context without a weight is not followed by any gram, back-off like kn and gkn do
+                weight[active[found_L]] = L[found_L]
+                low[active] = found_L
+            
+            batch_keys[active] = k >> bits
+            weights.append(weight)
+        
+        for weight in reversed(weights):
+            batch_probs = weight * batch_probs
+        
+        probs[batch] = batch_probs
+    
+    return probs
+
+
+'''
+Desc: Check if an n-gram has smoothed tables for the smoothing method and params of the arguments
+In  : n_gram (NGram), args (dict)
+Out : bool
+'''
+def has_smoothed(n_gram, args):
+    smoothing = getattr(n_gram, 'smoothing', None)
+
+    if smoothing == None or smoothing['method'] != args['method'] or smoothing['n'] != n_gram.N():
+        return False
+    
+    return all(args.get(k) == v for k, v in smoothing['params'].items())
+
+
 '''
 Desc: Get the probability of a tag sequence with specific arguments
 In  : tags (tuple), args (dict), aug (bool)
@@ -226,30 +446,64 @@ def _get_probability(tags, args, aug=False):
     elif aug and 'cache_aug' in args:
         cache = args['cache_aug']
 
+    # The smoothed tables hold unweighted probabilities, while gkn weights every order of its back-off
+    if has_smoothed(n_gram, args) and (w == 1 or args['method'] != 'gkn'):
+        return w * smoothed(tags, n_gram)
+
     # Call the corresponding probability/smoothing method
     if args['method'] == 'kn':
-        return w * kn(tags, n_gram, args['d'])
+        return w * kn(tags, n_gram, args['d'], cache=cache)
     
     elif args['method'] == 'gkn':
         d_cache = None
+        l_cache = None
 
         if not aug and 'd_cache' in args:
             d_cache = args['d_cache']
         elif aug and 'd_cache_aug' in args:
             d_cache = args['d_cache_aug']
 
-        return gkn(tags, n_gram, d_ceil=args['d_ceil'], cache=cache, w=w, d_cache=d_cache)
+        if not aug and 'l_cache' in args:
+            l_cache = args['l_cache']
+        elif aug and 'l_cache_aug' in args:
+            l_cache = args['l_cache_aug']
+
+        return gkn(tags, n_gram, d_ceil=args['d_ceil'], cache=cache, w=w, d_cache=d_cache, l_cache=l_cache)
     
     elif args['method'] == 'stupid_backoff':
         return w * stupid_backoff(tags, n_gram, args['alpha'], cache=cache)
         
 
 '''
-Desc: Wrapper for _get_probability function
-In  : tags (tuple), args (dict)
+Desc: Get the tags of the word augmented from a syllable-segmented word (see flip_onsets_word and
+      transpose_nucleus_word). The augmentation only depends on the word, method and vowel configuration, so it is
+      memoized with a bounded cache
+In  : syl_word (str), method (str), vowels (tuple), semi_vowels (tuple), diphtongs (tuple)
+Out : tuple, None if the word can not be augmented
+'''
+@functools.lru_cache(maxsize=AUG_WORD_CACHE_SIZE)
+def augment_word_tags(syl_word, method, vowels, semi_vowels, diphtongs):
+    augmented_word = None
+
+    if method == "flip_onsets":
+        augmented_word = flip_onsets_word(syl_word, vowels=vowels, semi_vowels=semi_vowels, diphtongs=diphtongs)
+    
+    elif method == "transpose_nucleus":
+        augmented_word = transpose_nucleus_word(syl_word, vowels=vowels, semi_vowels=semi_vowels, diphtongs=diphtongs)
+    
+    if augmented_word:
+        return util.segmented_word_to_tags(augmented_word[1])
+    
+    return None
+
+
+'''
+Desc: Wrapper for _get_probability function. The tags of the gram are decoded for its augmented words, unless
+      they are given in gram_tags
+In  : tags (tuple), args (dict), original_word (bool), gram_tags (tuple)
 Out : float
 '''
-def get_probability(tags, args, original_word=True):
+def get_probability(tags, args, original_word=True, gram_tags=None):
     prob = _get_probability(tags, args)
 
     if "with_aug" in args and args["with_aug"]:
@@ -258,28 +512,102 @@ def get_probability(tags, args, original_word=True):
     orig_prob = prob
     
     if original_word and args["can_aug_prob"]:
+        n_gram = args['n_gram']
+        tags = n_gram.decode_gram(tags) if gram_tags == None else gram_tags
         n = len(tags)
-        syl_word = util.tags_to_segmented_word(args["word"][:n], tags)
+
+        # A tag unknown to a packed n-gram can not be decoded, so without gram_tags its word is not augmented
+        syl_word = None if None in tags else util.tags_to_segmented_word(args["word"][:n], tags)
 
         for method in args["aug_prob_methods"]:
             if args["aug_prob_methods"][method]:
-                augmented_word = None
-
-                if method == "flip_onsets":
-                    augmented_word = flip_onsets_word(syl_word, vowels=args["vowels"], semi_vowels=args["semi_vowels"], diphtongs=args["diphtongs"])
-                
-                elif method == "transpose_nucleus":
-                    augmented_word = transpose_nucleus_word(syl_word, vowels=args["vowels"], semi_vowels=args["semi_vowels"], diphtongs=args["diphtongs"])
+                augmented_tags = augment_word_tags(syl_word, method, tuple(args["vowels"]), tuple(args["semi_vowels"]), tuple(args["diphtongs"])) if syl_word != None else None
 
-                if augmented_word:
-                    augmented_tags = util.segmented_word_to_tags(augmented_word[1])
-                    prob += get_probability(augmented_tags, args, original_word=False)
+                if augmented_tags:
+                    prob += get_probability(n_gram.encode_gram(augmented_tags), args, original_word=False)
                 else:
                     prob += orig_prob
 
     return prob
 
 
+'''
+Desc: Check if a batch of grams can be scored with smoothed_batch, i.e. the n-grams are packed into 64 bits keys
+      with one vocabulary and have smoothed tables the arguments can use, and no augmented word is scored
+In  : args (dict)
+Out : bool
+'''
+def can_batch(args):
+    if args.get("can_aug_prob"):
+        return False
+    
+    n_gram_keys = ['n_gram', 'n_gram_aug'] if args.get("with_aug") else ['n_gram']
+
+    for key in n_gram_keys:
+        n_gram = args[key]
+
+        if not isinstance(n_gram, ngram.PackedNGram) or n_gram.vocab is not args['n_gram'].vocab or n_gram.N() * n_gram.bits > 64:
+            return False
+        
+        # The smoothed tables hold unweighted probabilities, while gkn weights every order of its back-off
+        if not has_smoothed(n_gram, args) or (key == 'n_gram_aug' and args['aug_w'] != 1 and args['method'] == 'gkn'):
+            return False
+    
+    return True
+
+
+'''
+Desc: Get the log probabilities of a batch of grams with specific arguments, e.g. every transition of a word in the
+      tagger. The batch is scored with vectorized lookups if possible (see can_batch), else gram by gram, keeping
+      the log probabilities in the log probability cache of the arguments so a gram scored again is one lookup,
+      also with its augmented words. The tags of the grams scored with their augmented words can be given in tags,
+      as a tag unknown to a packed n-gram is not decoded from its key
+In  : grams (list), args (dict), tags (list)
+Out : np.ndarray
+'''
+def get_log_probabilities(grams, args, tags=None):
+    if can_batch(args):
+        probs = smoothed_batch(grams, args['n_gram'])
+
+        if args.get("with_aug"):
+            probs += args['aug_w'] * smoothed_batch(grams, args['n_gram_aug'])
+        
+        with np.errstate(divide='ignore'):
+            return np.log(probs)
+    
+    # The probability of a gram scored with its augmented words also depends on the letters of the word it covers
+    log_cache = args.get("log_cache")
+
+    if args.get("can_aug_prob"):
+        level = 'aug'
+        keys = [(gram if tags == None else tags[idx], args["word"][:args['n_gram'].get_order(gram)]) for idx, gram in enumerate(grams)]
+    else:
+        level = 'log'
+        keys = grams
+
+    logprobs = np.zeros(len(grams))
+    missing = []
+
+    for idx, key in enumerate(keys):
+        logprob = log_cache.get(level, key) if log_cache != None else None
+
+        if logprob == None:
+            missing.append(idx)
+        else:
+            logprobs[idx] = logprob
+    
+    probs = np.array([get_probability(grams[idx], args, gram_tags=None if tags == None else tags[idx]) for idx in missing], dtype=np.float64)
+
+    with np.errstate(divide='ignore'):
+        logprobs[missing] = np.log(probs)
+    
+    if log_cache != None:
+        for idx in missing:
+            log_cache.put(level, keys[idx], float(logprobs[idx]))
+    
+    return logprobs
+
+
 '''
 Desc: Get the emission probability given a tag for a symbol
 In  : symbol (str), tag (str), n_gram (NGram)
@@ -293,15 +621,99 @@ def get_emission_prob(symbol, tag, n_gram):
 
 
 '''
-Desc: Initialize a probability cache
-In  : n (int)
+Desc: Get the emission log probability given a tag for a symbol from an emission log probability table (see
+      generate_emission_logprob)
+In  : symbol (str), tag (str), emission_logprob (dict)
+Out : float
+'''
+def get_emission_logprob(symbol, tag, emission_logprob):
+    if tag in emission_logprob:
+        return emission_logprob[tag].get(symbol, -np.inf)
+    else:
+        return 0.0
+
+
+'''
+Desc: Initialize an emission log probability table, the emission probabilities of an n-gram in log space
+In  : n_gram (NGram)
 Out : dict
 '''
-def generate_prob_cache(n):
-    return {
-        'top': {i: {} for i in range(1, n+1)},
-        'low': {i: {} for i in range(1, n+1)} 
-    }
+def generate_emission_logprob(n_gram):
+    return {tag: {symbol: float(util.log_prob(prob)) for symbol, prob in ep.items()} for tag, ep in n_gram.emission_prob.items()}
+
+
+'''
+Desc: Probability cache of the smoothing methods, keyed by level (top for the highest order, low for the
+      back-off of kn and gkn) and tags. If max_size (entries) is set, the least recently used probability is
+      evicted once the cache is full
+'''
+class ProbCache():
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+
+    '''
+    Desc: Get a probability from the cache
+    In  : level (str), tags (tuple)
+    Out : float, None if it is not cached
+    '''
+    def get(self, level, tags):
+        key = (level, tags)
+        prob = self.entries.get(key)
+
+        if prob == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+            if self.max_size != None:
+                self.entries.move_to_end(key)
+        
+        return prob
+    
+
+    '''
+    Desc: Store a probability in the cache, evicting the least recently used one if the cache is full
+    In  : level (str), tags (tuple), prob (float)
+    F.S.: Probability cached
+    '''
+    def put(self, level, tags, prob):
+        self.entries[(level, tags)] = prob
+
+        if self.max_size != None and len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+    
+
+    def __len__(self):
+        return len(self.entries)
+    
+
+    '''
+    Desc: Get the counters of the cache, saved in the result log
+    Out : dict
+    '''
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self.entries),
+            'max_size': self.max_size
+        }
+
+
+'''
+Desc: Initialize a probability cache
+In  : max_size (int), max entries of the cache, unbounded if None
+Out : ProbCache
+'''
+def generate_prob_cache(max_size=None):
+    return ProbCache(max_size)
 
 
 '''
@@ -322,50 +734,203 @@ def generate_gkn_discount_cache(n, n_gram, ceil):
 
 
 '''
-Desc: Save a probability cache to a file
-In  : cache (dict), fname (str), folder (str)
+Desc: Initialize a normalizing constant (lambda) cache of gkn with the lambda of every context of the n-gram,
+      so gkn gets it with one lookup. A context without a lambda is one gkn backs off from
+In  : n (int), n_gram (NGram), ceil (int), d_cache (dict)
+Out : dict
 '''
-def save_cache(cache, fname, folder='./'):
-    data = {}
+def generate_gkn_lambda_cache(n, n_gram, ceil, d_cache):
+    l_cache = {}
+
+    for i in range(1, n):
+        l_cache[i] = {}
+
+        for tags in n_gram.get_fdist(i):
+            L = gkn_lambda(tags, n_gram.get_count(tags), n_gram, d_ceil=ceil, d_cache=d_cache)
+
+            if L != None:
+                l_cache[i][tags] = L
     
-    # Access top and low level of the cache
-    for level in cache:
-        data[level] = {}
+    return l_cache
 
-        # Access each nth-gram order of the cache
-        for i in cache[level]:
-            data[level][i] = {}
 
-            # Access each gram item of the cache
-            for k, v in cache[level][i].items():
-                data[level][i][util.tags_to_str(k)] = v 
+'''
+Desc: Normalizing constant (lambda) cache of gkn of one order that computes the lambda of a context on its first
+      lookup, for an n-gram whose contexts are too many to read up front (e.g. an SQLiteNGram). The least recently
+      used lambda is evicted once the cache holds max_size entries
+'''
+class LazyLambdaCache():
+    def __init__(self, n_gram, ceil, d_cache, max_size):
+        self.n_gram = n_gram
+        self.ceil = ceil
+        self.d_cache = d_cache
+        self.max_size = max_size
+        self.entries = OrderedDict()
     
-    with open('{}{}'.format(folder, fname), mode='w') as f:
-        f.write(json.dumps(data))
+
+    '''
+    Desc: Get the lambda of a context, computing it if it is not cached
+    In  : tags (tuple)
+    Out : float, None if gkn backs off from the context
+    '''
+    def get(self, tags):
+        if tags in self.entries:
+            self.entries.move_to_end(tags)
+            return self.entries[tags]
+        
+        L = self.entries[tags] = gkn_lambda(tags, self.n_gram.get_count(tags), self.n_gram, d_ceil=self.ceil, d_cache=self.d_cache)
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        
+        return L
+    
+
+    def __len__(self):
+        return len(self.entries)
 
 
 '''
-Desc: Load a probability cache from a file
-In  : fname (str), folder (str)
+Desc: Initialize a lazy normalizing constant (lambda) cache of gkn, one LazyLambdaCache per order, so the lambdas
+      are computed as gkn looks them up instead of for every context of the n-gram
+In  : n (int), n_gram (NGram), ceil (int), d_cache (dict), max_size (int), max entries of each order
 Out : dict
 '''
-def load_cache(fname, folder='./'):
-    with open('{}{}'.format(folder, fname)) as f:
-        data = json.loads(f.read())
+def generate_lazy_gkn_lambda_cache(n, n_gram, ceil, d_cache, max_size):
+    return {i: LazyLambdaCache(n_gram, ceil, d_cache, max_size) for i in range(1, n)}
+
+
+'''
+Desc: Precompute the smoothed probability of every gram of an n-gram and the back-off weight of every context,
+      so the tagger gets a probability from a lookup instead of the recursion of the smoothing method (see
+      smoothed). The tables hold the same values the method computes when tagging with the n of the n-gram
+In  : n_gram (NGram), method (str), d (float), d_ceil (int), alpha (float), verbose (bool)
+F.S.: Smoothed tables stored in the n-gram
+'''
+def generate_smoothed(n_gram, method="gkn", d=0.75, d_ceil=3, alpha=0.4, verbose=False):
+    n = n_gram.N()
+    cache = generate_prob_cache()
+
+    if method == "gkn":
+        d_cache = generate_gkn_discount_cache(n, n_gram, d_ceil)
+        l_cache = generate_gkn_lambda_cache(n, n_gram, d_ceil, d_cache)
+        params = {'d_ceil': d_ceil}
+    elif method == "kn":
+        params = {'d': d}
+    elif method == "stupid_backoff":
+        params = {'alpha': alpha}
+
+    def get_prob(tags, highest_order=True):
+        if method == "kn":
+            return kn(tags, n_gram, d=d, highest_order=highest_order, cache=cache)
+        elif method == "gkn":
+            return gkn(tags, n_gram, d_ceil=d_ceil, cache=cache, d_cache=d_cache, l_cache=l_cache, highest_order=highest_order)
+        elif method == "stupid_backoff":
+            return stupid_backoff(tags, n_gram, alpha=alpha, cache=cache)
     
-    cache = {}
+    n_gram.smoothed_prob = {}
+    n_gram.smoothed_low_prob = {}
+    n_gram.backoff_weight = {}
 
-    # Access top and low level of the data
-    for level in data:
-        cache[level] = {}
+    for i in range(1, n+1):
+        n_gram.smoothed_prob[i] = {tags: get_prob(tags) for tags in n_gram.get_fdist(i)}
 
-        # Access each nth-gram order of the data
-        for i, data_i in data[level].items():
-            i = int(i)
-            cache[level][i] = {}
+        # Stupid backoff has a constant back-off weight and no lower order probabilities
+        if method == "stupid_backoff":
+            continue
 
-            # Access each gram item of the data
-            for k, v in data_i.items():
-                cache[level][i][util.str_to_tags(k)] = float(v)
+        if 1 < i < n:
+            n_gram.smoothed_low_prob[i] = {tags: get_prob(tags, highest_order=False) for tags in n_gram.get_continuation_fdist(i)}
+        
+        # Weights of the contexts of the (i+1)-grams, the lambda cache of gkn
+        if i < n and method == "gkn":
+            n_gram.backoff_weight[i] = l_cache[i]
+        elif i < n:
+            n_gram.backoff_weight[i] = {tags: kn_lambda(tags, n_gram.get_count(tags), n_gram, d=d) for tags in n_gram.get_fdist(i)}
+    
+    # Probability of an unseen unigram
+    unk = 0 / n_gram.get_total_count(1) if method == "stupid_backoff" else 1 / n_gram.get_type_count(2)
+
+    n_gram.smoothing = {'method': method, 'params': params, 'n': n, 'unk': unk}
+
+    n_prob = sum(len(t) for t in n_gram.smoothed_prob.values()) + sum(len(t) for t in n_gram.smoothed_low_prob.values())
+    n_weight = sum(len(t) for t in n_gram.backoff_weight.values())
+    util.printv(verbose, f"Smoothed tables: {method} {params}, {n_prob} probabilities, {n_weight} back-off weights")
+
+
+'''
+Desc: Get the key of the probabilities of an n-gram in a persistent cache, made of the hash of the content of the
+      n-gram file and the smoothing method and parameters its probabilities depend on
+In  : file_hash (str), n (int), args (dict), aug (bool)
+Out : str
+'''
+def get_cache_key(file_hash, n, args, aug=False):
+    param = CACHE_KEY_PARAMS[args['method']]
+    key = {'n_gram': file_hash, 'n': n, 'method': args['method'], param: args[param]}
+
+    # gkn weights every order of the augmented n-gram, so the cached probabilities depend on the weight
+    if aug:
+        key['aug_w'] = args['aug_w']
+    
+    return json.dumps(key, sort_keys=True)
+
+
+'''
+Desc: Save the probabilities of a probability cache to a persistent cache, an SQLite table indexed by key, level and
+      tags, so several n-grams and parameters share one file. The tags are saved decoded, so the probabilities can
+      be loaded into an n-gram with other packed keys
+In  : cache (ProbCache), n_gram (NGram), key (str), fpath (str)
+F.S.: Probabilities saved in the file
+'''
+def save_cache(cache, n_gram, key, fpath):
+    conn = sqlite3.connect(fpath)
+
+    try:
+        with conn:
+            conn.executescript(CACHE_TABLES_SQL)
+            conn.execute('INSERT OR IGNORE INTO cache_key (key) VALUES (?)', (key,))
+            key_id = conn.execute('SELECT id FROM cache_key WHERE key = ?', (key,)).fetchone()[0]
+
+            # A gram with a tag unknown to the packed n-gram can not be decoded, it is not saved
+            entries = ((level, n_gram.decode_gram(tags), prob) for (level, tags), prob in cache.entries.items())
+
+            conn.executemany(
+                'INSERT OR IGNORE INTO prob_cache VALUES (?, ?, ?, ?)',
+                ((key_id, level, util.tags_to_str(tags), prob) for level, tags, prob in entries if None not in tags)
+            )
+    finally:
+        conn.close()
+
+
+'''
+Desc: Load the probabilities of a key from a persistent cache (see save_cache). Only the rows of the key are read,
+      through the index of the table, up to max_size of them
+In  : n_gram (NGram), key (str), fpath (str), max_size (int)
+Out : ProbCache, empty if the file or the key does not exist yet
+'''
+def load_cache(n_gram, key, fpath, max_size=None):
+    cache = ProbCache(max_size)
+
+    if not os.path.exists(fpath):
+        return cache
+    
+    conn = sqlite3.connect(fpath)
+
+    try:
+        conn.executescript(CACHE_TABLES_SQL)
+        rows = conn.execute(
+            'SELECT level, tags, prob FROM prob_cache JOIN cache_key ON key_id = id WHERE key = ? LIMIT ?',
+            (key, -1 if max_size == None else max_size)
+        )
+
+        for level, tags_str, prob in rows:
+            tags = util.str_to_tags(tags_str)
+            gram = n_gram.encode_gram(tags)
+
+            # A tag unknown to the packed n-gram would share its key with the other unknown tags
+            if n_gram.decode_gram(gram) == tags:
+                cache.put(level, gram, prob)
+    finally:
+        conn.close()
     
-    return cache
\ No newline at end of file
+    return cache
@@ -1,5 +1,6 @@
 import time
 import sys
+import ngram
 import pandas as pd
 import testing.tagger as tagger
 import testing.probability as probability
@@ -38,12 +39,29 @@ def mismatch_count(pred_syl, truth_syl):
     return count
 
 
+'''
+Desc: Initialize the gkn lambda cache of the main or augmented n-gram, a lazy one bounded by the cache size (or the
+      row cache size) for an SQLite n-gram
+In  : n (int), n_gram (NGram), prob_args (dict), aug (bool)
+Out : dict
+'''
+def generate_l_cache(n, n_gram, prob_args, aug=False):
+    d_cache = prob_args["d_cache_aug"] if aug else prob_args["d_cache"]
+
+    if isinstance(n_gram, ngram.SQLiteNGram):
+        max_size = prob_args.get("cache_size") or n_gram.cache_size
+        return probability.generate_lazy_gkn_lambda_cache(n, n_gram, prob_args["d_ceil"], d_cache, max_size)
+    
+    return probability.generate_gkn_lambda_cache(n, n_gram, prob_args["d_ceil"], d_cache)
+
+
 '''
 Desc: Syllabify each word in the test set
-In  : data_test (pd.DataFrame), n (int), prob_args (dict), *args
+In  : data_test (pd.DataFrame), n (int), prob_args (dict), *args, cache (ProbCache), cache_aug (ProbCache), caches
+      to start from (e.g. loaded from a persistent cache), new ones if None
 Out : pd.DataFrame
 '''
-def syllabify(data_test, n, prob_args, state_elim=True, stemmer=None, mode="syl", g2p_map=None, char_strips="", validation=True, verbose=True, stop=lambda: False):
+def syllabify(data_test, n, prob_args, state_elim=True, stemmer=None, mode="syl", g2p_map=None, char_strips="", validation=True, verbose=True, cache=None, cache_aug=None, stop=lambda: False):
     if mode == "syl":
         er_str = "ser"
         unit_str = "syllable"
@@ -57,19 +75,29 @@ def syllabify(data_test, n, prob_args, state_elim=True, stemmer=None, mode="syl"
     util.printv(verbose, f"Total words: {total_words}")
 
     # n-gram probability cache
-    prob_args["cache"] = probability.generate_prob_cache(n)
+    prob_args["cache"] = cache if cache != None else probability.generate_prob_cache(prob_args.get("cache_size"))
 
-    # GKN discount cache
+    # Log probability cache of the transitions of the tagger
+    prob_args["log_cache"] = probability.generate_prob_cache(prob_args.get("cache_size"))
+
+    # Emission probabilities in log space
+    if mode == "g2p":
+        prob_args["emission_logprob"] = probability.generate_emission_logprob(prob_args["n_gram"])
+
+    # GKN discount and lambda caches. The lambdas of an SQLite n-gram are computed as they are looked up, in a cache
+    # bounded like its rows, since computing them up front reads every context of the file into memory
     if prob_args["method"] == "gkn":
         prob_args["d_cache"] = probability.generate_gkn_discount_cache(n, prob_args["n_gram"], prob_args["d_ceil"])
+        prob_args["l_cache"] = generate_l_cache(n, prob_args["n_gram"], prob_args)
     
     # Augmented n-gram probability cache
     if prob_args["with_aug"]:
-        prob_args["cache_aug"] = probability.generate_prob_cache(n)
+        prob_args["cache_aug"] = cache_aug if cache_aug != None else probability.generate_prob_cache(prob_args.get("cache_size"))
 
-        # GKN discount cache
+        # GKN discount and lambda caches
         if prob_args["method"] == "gkn":
             prob_args["d_cache_aug"] = probability.generate_gkn_discount_cache(n, prob_args["n_gram_aug"], prob_args["d_ceil"])
+            prob_args["l_cache_aug"] = generate_l_cache(n, prob_args["n_gram_aug"], prob_args, aug=True)
 
     wrong_words = 0
     total_syllables = 0
@@ -150,6 +178,15 @@ def syllabify(data_test, n, prob_args, state_elim=True, stemmer=None, mode="syl"
     
     end_t = time.time()
 
+    # Probability cache counters
+    cache_stats = {'prob_cache': prob_args["cache"].get_stats(), 'log_prob_cache': prob_args["log_cache"].get_stats()}
+
+    if prob_args["with_aug"]:
+        cache_stats['prob_cache_aug'] = prob_args["cache_aug"].get_stats()
+    
+    for key, stats in cache_stats.items():
+        util.printv(verbose, '{}: {} hits, {} misses, {} evictions'.format(key, stats['hits'], stats['misses'], stats['evictions']))
+
     return {
         'data': data_result,
         'metadata': {
@@ -163,7 +200,8 @@ def syllabify(data_test, n, prob_args, state_elim=True, stemmer=None, mode="syl"
             f'{unit_str}_error_rate': round(syllable_error_rate, 8),
             'start_time': time.strftime('%Y/%m/%d - %H:%M:%S', time.localtime(start_t)),
             'end_time': time.strftime('%Y/%m/%d - %H:%M:%S', time.localtime(end_t)),
-            'duration': round(end_t - start_t, 2)
+            'duration': round(end_t - start_t, 2),
+            **cache_stats
         }
     }
 
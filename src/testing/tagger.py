@@ -227,31 +227,73 @@ def _tag_word(word, n, prob_args, state_elim=True, mode="syl", g2p_map=None, pre
     elif mode == "g2p":
         states = generate_states_g2p(word, n-1, g2p_map, state_elim=state_elim, pre_phoneme=pre_phoneme)
     
+    # Log probabilities of the paths, in Python floats so the loops below do no NumPy scalar arithmetic
     N = len(max(states, key=len))
-    V = np.full((T, N), -np.inf)
+    V = [[-np.inf] * N for _ in range(T)]
     B = {}
 
+    # Gram keys of each state, encoded once per word (packed ints for a PackedNGram)
+    n_gram = prob_args["n_gram"]
+    state_keys = [[n_gram.encode_gram(state) for state in states_t] for states_t in states]
+
+    # Emission probabilities in log space (see generate_emission_logprob)
+    if mode == "g2p":
+        emission_logprob = prob_args["emission_logprob"] if "emission_logprob" in prob_args else probability.generate_emission_logprob(n_gram)
+
     prob_calc = 0
     
     # Initial state, consists of padding tags STARTPAD
     initial_state = tuple(STARTPAD for _ in range(n-1))
+
+    # Transition probabilities do not depend on the path, so the transitions of every time step are scored with
+    # one call (see get_log_probabilities). The time step whose augmented words are scored has a call of its own
+    aug_t = n-1 if n-1 < T-1 and "aug_prob" in prob_args and prob_args["aug_prob"] else None
+    prev_states = {0: {initial_state[1:]: [None]}}
+    transition_tags = {False: [], True: []}
+
+    # Tags of the transitions scored with their augmented words, which a packed n-gram may not decode
+    aug_tags = []
+
+    for t in range(0, T):
+        # Previous states that each state can follow, the ones whose last tags are the first tags of the state
+        if t > 0:
+            prev_states[t] = {}
+
+            for i, prev_state in enumerate(states[t]):
+                prev_states[t].setdefault(prev_state[1:], []).append(i)
+        
+        for j, state in enumerate(states[t+1]):
+            for i in prev_states[t].get(state[:-1], []):
+                first_tag = initial_state[0] if t == 0 else states[t][i][0]
+                transition_tags[t == aug_t].append(n_gram.prepend_tag(first_tag, state_keys[t+1][j]))
+
+                if t == aug_t:
+                    aug_tags.append((first_tag,) + states[t+1][j])
+    
+    prob_args["can_aug_prob"] = False
+    tr_logprobs = iter(probability.get_log_probabilities(transition_tags[False], prob_args).tolist())
+
+    if aug_t != None:
+        prob_args["can_aug_prob"] = True
+        aug_tr_logprobs = iter(probability.get_log_probabilities(transition_tags[True], prob_args, aug_tags).tolist())
+        prob_args["can_aug_prob"] = False
     
     # Starting log probabilities
     symbol = word[0]
     util.printv(verbose, 'Current symbol:', symbol)
-    prob_args["can_aug_prob"] = False
 
     for i, state in enumerate(states[1]):
-        tags = (initial_state[0], ) + state
-        tr_logprob = util.log_prob(probability.get_probability(tags, prob_args))
+        tr_logprob = next(tr_logprobs)
 
         if mode == "g2p":
-            tr_logprob += util.log_prob(probability.get_emission_prob(word[0], state[-1], prob_args["n_gram"]))
+            tr_logprob += probability.get_emission_logprob(word[0], state[-1], emission_logprob)
 
         prob_calc += 1
 
-        util.printv(verbose, '[{}] {}->{} : {:.5f}'.format(i, initial_state, state, tr_logprob))
-        V[0, i] = tr_logprob
+        if verbose:
+            util.printv(verbose, '[{}] {}->{} : {:.5f}'.format(i, initial_state, state, tr_logprob))
+        
+        V[0][i] = tr_logprob
         B[0, state] = None
     
     # Find the maximum log probabilities reaching each state at time t
@@ -259,34 +301,34 @@ def _tag_word(word, n, prob_args, state_elim=True, mode="syl", g2p_map=None, pre
         symbol = word[t]
         util.printv(verbose, '\nCurrent symbol:', symbol)
 
-        if t == n-1 and t < T-1 and "aug_prob" in prob_args and prob_args["aug_prob"]:
-            prob_args["can_aug_prob"] = True
-        else:
-            prob_args["can_aug_prob"] = False
+        step_tr_logprobs = aug_tr_logprobs if t == aug_t else tr_logprobs
+        
+        V_prev = V[t-1]
         
         for j, state in enumerate(states[t+1]):
             best = (-np.inf, None)
 
-            for i, prev_state in enumerate(states[t]):
-                # Skip if the last tag of prev_state doesn't match with the first tag of the current state
-                if prev_state[1:] != state[:-1]:
-                    continue
+            # The emission of a state does not depend on the previous state
+            if mode == "g2p" and word[t] != WORDEND:
+                em_logprob = probability.get_emission_logprob(word[t], state[-1], emission_logprob)
 
-                tags = (prev_state[0], ) + state
-                tr_logprob = util.log_prob(probability.get_probability(tags, prob_args))
+            for i in prev_states[t].get(state[:-1], []):
+                prev_state = states[t][i]
+                tr_logprob = next(step_tr_logprobs)
 
                 if mode == "g2p" and word[t] != WORDEND:
-                    tr_logprob += util.log_prob(probability.get_emission_prob(word[t], state[-1], prob_args["n_gram"]))
+                    tr_logprob += em_logprob
                 
-                va = V[t-1, i] + tr_logprob
+                va = V_prev[i] + tr_logprob
                 prob_calc += 1
 
-                util.printv(verbose, '[{}, {}] {}->{} : {:.5f} | Sum: {:.5f}'.format(i, j, prev_state, state, tr_logprob, va))
+                if verbose:
+                    util.printv(verbose, '[{}, {}] {}->{} : {:.5f} | Sum: {:.5f}'.format(i, j, prev_state, state, tr_logprob, va))
                 
                 if va >= best[0]:
                     best = (va, prev_state)
                 
-            V[t, j] = best[0]
+            V[t][j] = best[0]
             B[t, state] = best[1] #if best[1] != None else states[np.argmax(V[t-1])]
     
     util.printv(verbose, '\nTotal probability calculations:', prob_calc)
@@ -294,7 +336,7 @@ def _tag_word(word, n, prob_args, state_elim=True, mode="syl", g2p_map=None, pre
     # Find the biggest probability for final state
     best = None
     for i, state in enumerate(states[T]):
-        val = V[T-1, i]
+        val = V[T-1][i]
         if not best or val > best[0]:
             best = (val, state)
     
@@ -1,5 +1,6 @@
 import utility as util
 import pandas as pd
+import functools
 import math
 import re
 import time
@@ -19,23 +20,39 @@ CONSONANT_SWAP_MAP = {
     'l': 'r', 'r': 'l',
 }
 
+'''
+Desc: Compile the nucleus patterns of a vowel configuration, once per configuration
+In  : vowels (tuple), semi_vowels (tuple), diphtongs (tuple)
+Out : tuple
+'''
+@functools.lru_cache(maxsize=None)
+def get_nucleus_patterns(vowels, semi_vowels, diphtongs):
+    return (
+        re.compile(r'{}'.format('|'.join(diphtongs))),
+        re.compile(r'[{}]+'.format(''.join(vowels))),
+        [re.compile(r'\B{}+'.format(semi_vowel)) for semi_vowel in semi_vowels]
+    )
+
+
 '''
 Desc: Extract the onset, nucleus, and coda from a valid syllable
 In  : syllable (str)
 Out : tuple
 '''
 def extract_syllable(syllable, vowels=VOWELS_DEFAULT, semi_vowels=SEMI_VOWELS_DEFAULT, diphtongs=DIPHTONGS_DEFAULT):
+    diphtong_pattern, vowel_pattern, semi_vowel_patterns = get_nucleus_patterns(tuple(vowels), tuple(semi_vowels), tuple(diphtongs))
+
     # Check nucleus containing diphtongs
-    nuc_match = re.search(r'{}'.format('|'.join(diphtongs)), syllable)
+    nuc_match = diphtong_pattern.search(syllable)
 
     # Check nucleus containing vowels from letters a, e, i, o, u
     if not nuc_match:
-        nuc_match = re.search(r'[{}]+'.format(''.join(vowels)), syllable)
+        nuc_match = vowel_pattern.search(syllable)
     
     # Check for letter y as a semi-vocal
     if not nuc_match:
-        for semi_vowel in semi_vowels:
-            nuc_match = re.search(r'\B{}+'.format(semi_vowel), syllable)
+        for semi_vowel_pattern in semi_vowel_patterns:
+            nuc_match = semi_vowel_pattern.search(syllable)
 
             if nuc_match:
                 break
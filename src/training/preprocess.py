@@ -1,40 +1,36 @@
-from nltk.util import pad_sequence
 from config import *
 
 '''
-Desc: Convert syllable-segmented text to tokens of tags
+Desc: Join a column of words into one text, with every hyphen-separated sub-word on its own line
+In  : words (pd.Series)
+Out : str
+'''
+def join_sub_words(words):
+    return '\n'.join(words).replace('-', '\n') + '\n'
+
+
+'''
+Desc: Convert syllable-segmented text to tokens of tags. The whole column is tagged at once: every letter
+      gets SYLMID, then letters followed by a syllable boundary or the end of a sub-word are turned into SYLEND
 In  : data_train (pd.DataFrame)
 Out : List
 '''
 def tokenize(data_train):
-    tokens = []
-
-    for syl_word in data_train['syllables']:
-        # Split words that have hyphen
-        syl_sub_words  = syl_word.replace('-', ' ').split() 
+    text = join_sub_words(data_train['syllables'])
 
-        for syl_sub_word in syl_sub_words:
-            n = len(syl_sub_word)
-            word_tokens = []
+    # Whitespaces end a sub-word, other letters are tagged as SYLMID
+    table = {}
 
-            for i in range(n):
-                # Skip if the current char is a syllable boundary
-                if syl_sub_word[i] == '.':
-                    continue
-                # Last char is always a syllable-end
-                if i == n-1:
-                    token = syl_sub_word[i] + SYLEND
-                # If next char is a syllable boundary
-                elif syl_sub_word[i+1] == '.':
-                    token = syl_sub_word[i] + SYLEND
-                # If next char is not syllable boundary
-                else:
-                    token = syl_sub_word[i] + SYLMID
-                word_tokens.append(token)
-            
-            tokens.append(word_tokens)
+    for c in set(text):
+        if c.isspace():
+            table[ord(c)] = SYLBOUND + '\n'
+        elif c != SYLBOUND:
+            table[ord(c)] = c + SYLMID
     
-    return tokens
+    tagged = text.translate(table).replace(SYLMID + SYLBOUND, SYLEND).replace(SYLBOUND, '')
+
+    # Cut each sub-word into 2-character tags
+    return [list(map(''.join, zip(word[::2], word[1::2]))) for word in tagged.split()]
 
 
 '''
@@ -43,32 +39,18 @@ In  : data_train (pd.DataFrame)
 Out : List
 '''
 def tokenize_g2p(data_train):
-    tokens = []
-
-    for syl_word in data_train['syllables']:
-        # Split words that have hyphen
-        syl_sub_words  = syl_word.replace('-', ' ').split() 
-
-        for syl_sub_word in syl_sub_words:
-            tokens.append(list(syl_sub_word))
-    
-    return tokens
+    return [list(sub_word) for sub_word in join_sub_words(data_train['syllables']).split()]
 
 
 '''
-Desc: Pad the beginning of each word with n number of token '#' and the ending with an end marker
+Desc: Pad the beginning of each word with n-1 number of token STARTPAD and the ending with an end marker
 In  : tokens (List), n (int), start_pad (bool), end_marker (bool)
 Out : List
 '''
 def pad_tokens(tokens, n, start_pad=True, end_marker=True):
     assert start_pad or end_marker
+
+    start = [STARTPAD] * (n-1) if start_pad else []
+    end = [WORDEND] if end_marker else []
     
-    # Add front padding
-    if start_pad:
-        padded_tokens = [list(pad_sequence(wt, n, pad_left=True, left_pad_symbol=STARTPAD)) for wt in tokens]
-    
-    # Add end marker
-    if end_marker:
-        padded_tokens = [wt + [WORDEND] for wt in padded_tokens]
-    
-    return padded_tokens
\ No newline at end of file
+    return [start + wt + end for wt in tokens]